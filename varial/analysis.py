@@ -126,12 +126,16 @@ def get_stack_position(wrp):
 
 
 ################################################ result / folder management ###
+import collections
+import fingerprint
 import util
 
 cwd = settings.varial_working_dir
 _tool_stack = []
+_loaded_results = collections.OrderedDict()  # proxies, least recently used 1st
 results_base = None
 current_result = None
+proxies_from_disk = False  # find results of tools that ran in other processes
 
 
 def _mktooldir():
@@ -147,6 +151,7 @@ class ResultProxy(object):
     def __init__(self, tool, parent, path):
         self.name = tool.name
         self.io = tool.io
+        self.tool_names = getattr(tool, 'tool_names', {})
         self.parent = parent
         self.path = path
         self.children = {}
@@ -155,12 +160,28 @@ class ResultProxy(object):
             parent.children[self.name] = self
 
     def get_result(self):
-        if self.result is None:
+        """
+        Returns the result, loads it from the io module of the tool if needed.
+
+        At most ``settings.max_loaded_results`` loaded results are kept, the
+        least recently used ones are dropped (and loaded again if needed).
+        Results of tools that ran in this process are always kept.
+        """
+        if self in _loaded_results:
+            _loaded_results[self] = _loaded_results.pop(self)  # recently used
+        elif self.result is None:
             with util.Switch(self.io, 'use_analysis_cwd', False):
                 with self.io.block_of_files:
                     self.result = self.io.get(self.path + 'result') or 0
+            if self.result:
+                _add_loaded_result(self)
         return self.result or None
 
+    def set_result(self, result):
+        """Sets the result of a tool that ran (or was reused) here."""
+        _loaded_results.pop(self, None)
+        self.result = result
+
     def lookup(self, keys):
         if not keys:
             return self
@@ -169,9 +190,24 @@ class ResultProxy(object):
             return self.lookup(keys)
         if k == '..' and self.parent:
             return self.parent.lookup(keys)
+        if k not in self.children and proxies_from_disk:
+            self._add_child_from_disk(k)
         if k in self.children:
             return self.children[k].lookup(keys)
 
+    def _add_child_from_disk(self, name):
+        tool = self.tool_names.get(name)
+        if tool and os.path.isdir(self.path + name):
+            ResultProxy(tool, self, self.path + name + '/')
+
+
+def _add_loaded_result(proxy):
+    _loaded_results[proxy] = None
+    while (settings.max_loaded_results
+           and len(_loaded_results) > settings.max_loaded_results):
+        evicted, _ = _loaded_results.popitem(last=False)
+        evicted.result = None  # load again on next lookup
+
 
 def push_tool(tool):
     global current_result
@@ -187,7 +223,7 @@ def pop_tool():
     global current_result
     t = _tool_stack.pop()
     _mktooldir()
-    current_result.result = getattr(t, 'result', 0)
+    current_result.set_result(getattr(t, 'result', 0))
     current_result = current_result.parent
 
 
@@ -195,6 +231,43 @@ def get_current_tool_path():
     return "/".join(t.name for t in _tool_stack)
 
 
+def switch_to_tool_path(tool_path):
+    """
+    Sets tool stack, cwd and current result to a tool path.
+
+    Used to run a task from another process. Returns the former state for
+    ``restore_tool_path``.
+
+    :param tool_path:   str, as returned by ``get_current_tool_path``
+    """
+    global _tool_stack, cwd, current_result
+    if not _tool_stack:
+        raise RuntimeError(
+            'switch_to_tool_path: _tool_stack empty, %s' % tool_path)
+    state = _tool_stack, cwd, current_result
+    tokens = tool_path.split('/')
+    tool = state[0][0]
+    if tokens.pop(0) != tool.name:
+        raise RuntimeError(
+            'switch_to_tool_path: %s is not below %s' % (tool_path, tool.name))
+    stack, proxy = [tool], results_base
+    for tok in tokens:
+        tool = tool.tool_names[tok]
+        stack.append(tool)
+        proxy = (proxy.children.get(tok)
+                 or ResultProxy(tool, proxy, proxy.path + tok + '/'))
+    _tool_stack = stack
+    _mktooldir()
+    current_result = proxy
+    return state
+
+
+def restore_tool_path(state):
+    """Restores the state returned by ``switch_to_tool_path``."""
+    global _tool_stack, cwd, current_result
+    _tool_stack, cwd, current_result = state
+
+
 def _lookup(key):
     keys = key.split('/')
     if keys[0] in ('', '.'):
@@ -220,6 +293,8 @@ def lookup_result(key, default=None):
                     or None
     """
     res = _lookup(key)
+    if res:
+        fingerprint.record_lookup(res.path)
     if res and res.get_result():
         return res.result
     else:
@@ -342,6 +417,7 @@ def reset():
     all_samples = {}
     cwd = settings.varial_working_dir
     _tool_stack = []
+    _loaded_results.clear()
     results_base = None
     current_result = None
     fs_aliases = []
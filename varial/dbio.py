@@ -2,6 +2,12 @@
 Store wrappers into a sqlite database.
 
 Please checkout the :ref:`diskio-module` documentation for more information.
+Histograms are stored as raw bin arrays (see :ref:`payload-module`).
+
+The database runs in WAL mode, so worker processes can read while another
+process writes. Writes within ``block_of_files`` are grouped into one
+transaction, which is rolled back if the block raises an exception. The
+connection is closed before forking and reopened on demand.
 """
 
 import cPickle
@@ -9,79 +15,130 @@ import sqlite3
 
 import settings
 import analysis
+import payload
 
 
 _db_conn = None
+_db_name = None  # only if given to _init, else taken from analysis
+_in_a_block = 0  # number of opened blocks
+_in_transaction = False
 
 
 def _init(db_name=None):
-    global _db_conn
+    global _db_conn, _db_name
     if _db_conn:
         _close()
+    _db_name = db_name
     if not db_name:
         if analysis.results_base:
             db_name = analysis.results_base.path + settings.db_name
         else:
             db_name = settings.varial_working_dir + settings.db_name
-    _db_conn = sqlite3.connect(db_name, isolation_level='Exclusive')
-    _db_conn.isolation_level = None
+    _db_conn = sqlite3.connect(
+        db_name, timeout=settings.db_timeout, isolation_level=None)
     c = _db_conn.cursor()
+    c.execute('PRAGMA journal_mode = WAL')
+    c.execute('PRAGMA synchronous = NORMAL')
     c.execute('CREATE TABLE IF NOT EXISTS analysis (path VARCHAR UNIQUE, data)')
 
 
+def _conn():
+    if not _db_conn:
+        _init(_db_name)
+    return _db_conn
+
+
 def _close():
     global _db_conn
     if not _db_conn:
         return
-    _db_conn.commit()
+    _commit()
     _db_conn.close()
     _db_conn = None
-    pass
 
 
-class _BlockMaker(dict):
+def _commit():
+    global _in_transaction
+    if _in_transaction:
+        _db_conn.execute('COMMIT')
+        _in_transaction = False
+
+
+def _rollback():
+    global _in_transaction
+    if _in_transaction:
+        _db_conn.execute('ROLLBACK')
+        _in_transaction = False
+
+
+class _BlockMaker(object):
     def __enter__(self):
-        pass
+        global _in_a_block
+        _in_a_block += 1
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if _db_conn:
-            _db_conn.commit()
+        global _in_a_block
+        _in_a_block -= 1
+        if not _in_a_block and _db_conn:
+            if exc_type:
+                _rollback()  # no half-written blocks
+            else:
+                _commit()
 
 
 block_of_files = _BlockMaker()
 
 
+def _prefix_range(path):
+    # all paths that start with path are in [path, upper), as U+10FFFF is the
+    # highest code point (and no character)
+    if not isinstance(path, unicode):
+        path = path.decode('utf-8')
+    return path, path + u'\U0010ffff'
+
+
+def _name(path, n_cwd):
+    try:
+        return str(path[n_cwd:])
+    except UnicodeEncodeError:
+        return path[n_cwd:]  # non-ascii names stay unicode
+
+
 ##################################################### read / write wrappers ###
 def exists(name):
-    raise NotImplementedError()
+    """Check if data exists."""
+    path = analysis.cwd + name
+    c = _conn().cursor()
+    c.execute('SELECT 1 FROM analysis WHERE path=?', (path,))
+    return bool(c.fetchone())
 
 
 def write(wrp, name=None):
-    """Write a wrapper."""
-    if not _db_conn:
-        _init()
+    """
+    Write a wrapper.
+
+    Within ``block_of_files``, the write is committed when the block is left.
+    """
+    global _in_transaction
+    conn = _conn()
+    if _in_a_block and not _in_transaction:
+        conn.execute('BEGIN IMMEDIATE')
+        _in_transaction = True
     path = analysis.cwd + (name or wrp.name)
-    c = _db_conn.cursor()
-    c.execute('PRAGMA synchronous = 0')
-    c.execute('PRAGMA journal_mode = OFF')
-    c.execute('DELETE FROM analysis WHERE path=?', (path,))
-    c.execute(
-        'INSERT INTO analysis VALUES (?,?)',
-        (path, cPickle.dumps(wrp))
+    conn.execute(
+        'INSERT OR REPLACE INTO analysis VALUES (?,?)',
+        (path, sqlite3.Binary(cPickle.dumps(payload.encode(wrp), 2)))
     )
-    _db_conn.commit()
 
 
 def read(name):
     """Read a wrapper."""
-    if not _db_conn:
-        _init()
     path = analysis.cwd + name
-    c = _db_conn.cursor()
+    c = _conn().cursor()
     c.execute('SELECT data FROM analysis WHERE path=?', (path,))
     data = c.fetchone()
     if data:
-        return cPickle.loads(str(data[0]))
+        return payload.decode(cPickle.loads(str(data[0])))
     else:
         raise RuntimeError('Data not found in db: %s' % path)
 
@@ -94,6 +151,47 @@ def get(name, default=None):
         return default
 
 
+def list_names(prefix=''):
+    """
+    Lists all names that start with prefix (e.g. all results of a tool).
+
+    Uses the index on path. The names are relative to ``analysis.cwd``.
+    """
+    path = analysis.cwd + prefix
+    c = _conn().cursor()
+    if path:
+        c.execute('SELECT path FROM analysis WHERE path >= ? AND path < ? '
+                  'ORDER BY path', _prefix_range(path))
+    else:
+        c.execute('SELECT path FROM analysis ORDER BY path')
+    n_cwd = len(analysis.cwd)
+    return list(_name(row[0], n_cwd) for row in c)
+
+
+def read_all(prefix=''):
+    """
+    Reads all wrappers with a name that starts with prefix in one query.
+
+    :returns:   dict(name => wrapper), names relative to ``analysis.cwd``
+    """
+    path = analysis.cwd + prefix
+    c = _conn().cursor()
+    if path:
+        c.execute('SELECT path, data FROM analysis '
+                  'WHERE path >= ? AND path < ?', _prefix_range(path))
+    else:
+        c.execute('SELECT path, data FROM analysis')
+    n_cwd = len(analysis.cwd)
+    return dict(
+        (_name(p, n_cwd), payload.decode(cPickle.loads(str(data))))
+        for p, data in c
+    )
+
+
 ################################################### write and close on exit ###
+import multiproc
 import atexit
+
+
+multiproc.pre_fork_cbs.append(_close)
 atexit.register(_close)
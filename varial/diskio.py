@@ -3,18 +3,32 @@ Read/Write wrappers to disk.
 
 On disk, a wrapper is represented by a .info file. If it contains root objects,
 there's a .root file with the same name in the same directory.
+
+The .info file is human readable python code by default. With
+``settings.diskio_binary_info``, a compact binary format with a version header
+is written instead. Both formats are recognized when reading.
 """
 
 import settings  #  init ROOT first
 
-from ROOT import TFile, TDirectory, TH1, TObject, TTree
+from ROOT import TFile, TDirectory, TH1, TObject, TTree, TBufferFile, TBuffer
 from os.path import basename, dirname, join
 from itertools import takewhile
 from ast import literal_eval
+from array import array
+import collections
+import hashlib
+import itertools
 import resource
+import cPickle
+import copy
+import marshal
+import struct
 import glob
 import os
 
+import fingerprint
+import writequeue
 import wrappers
 import history
 import monitor
@@ -43,29 +57,37 @@ class _BlockMaker(object):
         _in_a_block -= 1
         if not _in_a_block:
             for filename in _block_of_open_files:
-                file_handle = _open_root_files.pop(filename, 0)
-                if file_handle:
-                    file_handle.Close()
+                _close_handle(filename)
+            del _block_of_open_files[:]
 
 
-_open_root_files = {}
+_open_root_files = collections.OrderedDict()  # least recently used first
+_dir_cache = {}  # filename -> {dir_path: (TDirectory, {name: TKey})}
+_root_file_stats = {}  # filename -> [hits, misses, evictions]
 _block_of_open_files = []
 _in_a_block = 0  # number of opened blocks
+_warned_eviction = False
 block_of_files = _BlockMaker()
 
 
 def get_open_root_file(filename):
+    """
+    Returns a handle to an open root file.
+
+    Open files are kept in a pool of at most ``settings.max_open_root_files``
+    handles. If the pool is full, the least recently used file is closed.
+    """
+    fingerprint.record_file(filename)
+    stats = _root_file_stats.setdefault(filename, [0, 0, 0])
     if filename in _open_root_files:
-        file_handle = _open_root_files[filename]
+        stats[0] += 1
+        file_handle = _open_root_files.pop(filename)
+        _open_root_files[filename] = file_handle  # most recently used
     else:
-        if len(_open_root_files) > settings.max_open_root_files:
-            monitor.message(
-                'diskio',
-                'WARNING to many open root files. Closing all. '
-                'Please check for lost histograms. '
-                '(Use hist.SetDirectory(0) to keep them)'
-            )
-            close_open_root_files()
+        stats[1] += 1
+        while (_open_root_files
+               and len(_open_root_files) >= settings.max_open_root_files):
+            _evict_root_file()
         file_handle = TFile.Open(filename, 'READ')
         if (not file_handle) or file_handle.IsZombie():
             raise RuntimeError('Cannot open file with root: "%s"' % filename)
@@ -75,89 +97,125 @@ def get_open_root_file(filename):
     return file_handle
 
 
+def _evict_root_file():
+    global _warned_eviction
+    filename = next(iter(_open_root_files))
+    _close_handle(filename)
+    _root_file_stats[filename][2] += 1
+    if not _warned_eviction:
+        _warned_eviction = True
+        monitor.message(
+            'diskio',
+            'WARNING to many open root files. Closing least recently used. '
+            'Please check for lost histograms. '
+            '(Use hist.SetDirectory(0) to keep them)'
+        )
+
+
+def root_file_stats():
+    """
+    Returns usage counters of the root file pool.
+
+    :returns:   dict(filename => dict(hits=int, misses=int, evictions=int))
+    """
+    return dict(
+        (filename, dict(hits=h, misses=m, evictions=e))
+        for filename, (h, m, e) in _root_file_stats.iteritems()
+    )
+
+
 def close_open_root_files():
+    writequeue.wait()
     for name, file_handle in _open_root_files.iteritems():
         file_handle.Close()
     _open_root_files.clear()
+    _dir_cache.clear()
 
 
 def close_root_file(filename):
     if not filename[-5:] == '.root':
         filename += '.root'
-    if filename in _open_root_files:
-        _open_root_files[filename].Close()
-        del _open_root_files[filename]
+    _close_handle(filename)
+
+
+def _close_handle(filename):
+    _dir_cache.pop(filename, None)
+    file_handle = _open_root_files.pop(filename, 0)
+    if file_handle:
+        file_handle.Close()
 
 
 ##################################################### read / write wrappers ###
 def exists(filename):
     """Checks for existance."""
     filename = prepare_basename(filename)
+    writequeue.wait()
     return os.path.exists('%s.info' % filename)
 
 
 def read(filename):
     """Reads wrapper from disk, including root objects."""
-    filename = prepare_basename(filename) + '.info'
-    with open(filename) as f:
-        try:
-            info = _read_wrapper_info(f)
-        except ValueError as e:
-            monitor.message(
-                'diskio.read',
-                'ERROR can not read info: ' + filename
-            )
-            raise e
+    writequeue.wait()
+    return _read(prepare_basename(filename) + '.info')
 
-    if 'root_filename' in info:
-        _read_wrapper_objs(info, dirname(filename))
-    klass = getattr(wrappers, info.get('klass'))
-    if klass == wrappers.WrapperWrapper:
-        p = dirname(filename)
-        info['wrps'] = _read_wrapperwrapper(
-            join(p, f)
-            for f in info['wrpwrp_names']
-        )
-    wrp = klass(**info)
-    _clean_wrapper(wrp)
-    return wrp
+
+def read_member(filename, index):
+    """
+    Reads a single wrapper out of a stored WrapperWrapper.
+
+    In the container mode (see ``settings.diskio_wrpwrp_container``), only the
+    objects of this member are read from the root file.
+
+    :param filename:    str, filename of the WrapperWrapper
+    :param index:       int, index of the wrapper in the list
+    :returns:           Wrapper
+    """
+    writequeue.wait()
+    filename = prepare_basename(filename) + '.info'
+    info = _read_info_file(filename)
+    path = dirname(filename)
+    if 'wrpwrp_infos' in info:
+        return _read_container_member(info, path, index)
+    else:
+        return _read(join(path, info['wrpwrp_names'][index]) + '.info')
 
 
 def write(wrp, filename=None, suffices=(), mode='RECREATE'):
-    """Writes wrapper to disk, including root objects."""
+    """
+    Writes wrapper to disk, including root objects.
+
+    With ``settings.io_write_behind``, the files are written in the background
+    and only images are saved right away (see writequeue module).
+    """
     filename = prepare_basename(filename or wrp.name)
     if mode is not 'UPDATE':
         record_in_save_log(filename)
-
-    if settings.diskio_check_readability:
-        _check_readability(wrp)
-    # save with suffices
-    for suffix in suffices:
-        wrp.obj.SaveAs(filename + suffix)
-    # WrapperWrapper: store others first
-    if isinstance(wrp, wrappers.WrapperWrapper):
-        _write_wrapperwrapper(wrp, filename)
-    # write root objects (if any)
-    if any(isinstance(o, TObject) for o in wrp.__dict__.itervalues()):
-        wrp.root_filename = basename(filename+'.root')
-        f = TFile.Open(filename+'.root', mode)
-        f.cd()
-        _write_wrapper_objs(wrp, f)
-        f.Close()
-    # write wrapper infos
-    with open(filename+'.info', 'w') as f:
-        _write_wrapper_info(wrp, f)
-    _clean_wrapper(wrp)
+    _load_lazy_histos(wrp)
+
+    if writequeue.enabled():
+        # images are saved here, as root graphics are not thread-safe
+        if mode == 'RECREATE' and _is_unchanged(wrp, filename, suffices):
+            return
+        _save_images(wrp, filename, suffices)
+        # write a copy, as attributes are added and removed while writing
+        writequeue.submit(_write_files, writequeue.detach(wrp), filename, mode)
+        wrp.__dict__.pop('io_digest', None)
+    else:
+        _write(wrp, filename, suffices, mode)
 
 
 def small_write(wrp, filename, suffices=()):
     """Writes only according to the given suffices and the wrp info."""
     filename = prepare_basename(filename)
     record_in_save_log(filename)
-    with open(filename+'.info', 'w') as f:
-        _write_wrapper_info(wrp, f)
-    for suffix in suffices:
-        wrp.obj.SaveAs(filename + suffix)
+    if writequeue.enabled():
+        if _is_unchanged(wrp, filename, suffices, False):
+            return
+        _save_images(wrp, filename, suffices)
+        writequeue.submit(_write_info_only, writequeue.detach(wrp), filename)
+        wrp.__dict__.pop('io_digest', None)
+    else:
+        _small_write(wrp, filename, suffices)
 
 
 def get(filename, default=None):
@@ -176,14 +234,27 @@ def generate_aliases(glob_path='./*.root'):
 
 
 def generate_aliases_list(list_of_files=('',)):
-    """Looks for root files based on a list and produces aliases."""
+    """
+    Looks for root files based on a list and produces aliases.
+
+    The content of every file is looked up in the alias index first. Only
+    files that are not indexed or have changed on disk are scanned. If there
+    are many of them, they are scanned in parallel (see
+    ``settings.alias_scan_min_files_parallel``).
+    """
+    list_of_files = list(list_of_files)
+    if any(type(file_path) is not str for file_path in list_of_files):
+        raise RuntimeError(
+            'diskio.generate_aliases_list needs a list of strings')
+    scanned = _scan_in_parallel(list_of_files)
     for file_path in list_of_files:
-        if type(file_path) is not str:
-            raise RuntimeError(
-                'diskio.generate_aliases_list needs a list of strings')
-        root_file = get_open_root_file(file_path)
-        for ifp, typ in _recursive_path_and_type(root_file, ''):
+        if file_path in scanned:
+            content = scanned[file_path]
+        else:
+            content = _indexed_path_and_type(file_path)
+        for ifp, typ in content:
             yield wrappers.Alias(file_path, ifp, typ)
+    write_alias_index()
 
 
 def load_bare_object(alias):
@@ -199,12 +270,276 @@ def load_histogram(alias):
     return _wrapperize(histo, alias)
 
 
+def load_histogram_object(alias):
+    """
+    Returns the histogram for an alias, prepared as in load_histogram.
+
+    :returns:   (histogram, title as stored), the title is the wrapper title
+                in load_histogram
+    """
+    histo = load_bare_object(alias)
+    if hasattr(histo, 'SetDirectory'):
+        histo.SetDirectory(0)
+    _check_histo(histo, alias)
+    title = histo.GetTitle()
+    _prepare_histo(histo, alias)
+    return histo, title
+
+
+def lazy_load_histograms(aliases):
+    """
+    Returns a list of wrappers, which read their histogram on first access.
+
+    See wrappers.LazyHistoWrapper.
+    """
+    res = []
+    for alias in aliases:
+        wrp = wrappers.LazyHistoWrapper(alias, load_histogram_object)
+        wrp.history = _alias_history(alias)
+        res.append(wrp)
+    return res
+
+
 def bulk_load_histograms(aliases):
-    """Returns a list of wrappers with fileservice histograms."""
-    # todo with(SyncReadIo(timeout)): for the next statement
-    histos = list((load_bare_object(a), a) for a in aliases)
-    histos = list(_wrapperize(h, a) for h, a in histos)
-    return histos
+    """
+    Returns a list of wrappers with fileservice histograms.
+
+    Aliases are grouped by file. Every file is opened once and all its
+    histograms are read in one go. The wrappers are returned in the order of
+    the aliases.
+    """
+    aliases = list(aliases)
+    indices_by_file = collections.OrderedDict()
+    for i, alias in enumerate(aliases):
+        indices_by_file.setdefault(alias.file_path, []).append(i)
+
+    histos = [None] * len(aliases)
+    for file_path, indices in indices_by_file.iteritems():
+        was_open = file_path in _open_root_files
+        for i in indices:
+            obj = _get_obj_from_file(file_path, aliases[i].in_file_path)
+            if hasattr(obj, 'SetDirectory'):
+                obj.SetDirectory(0)
+            histos[i] = obj
+        if not (was_open or _in_a_block):
+            _close_handle(file_path)
+
+    return list(_wrapperize(h, a) for h, a in itertools.izip(histos, aliases))
+
+
+############################################################### alias index ###
+_alias_index = None  # abs file path -> ((size, mtime), [(in_file_path, type)])
+_alias_index_changed = False
+_alias_index_dropped = set()
+
+
+def _alias_index_path():
+    return settings.varial_working_dir + settings.alias_index_name
+
+
+def _get_alias_index():
+    global _alias_index
+    if _alias_index is None:
+        _alias_index = {}
+        path = _alias_index_path()
+        if os.path.exists(path):
+            try:
+                with open(path, 'rb') as f:
+                    index = cPickle.load(f)
+                assert isinstance(index, dict)
+                _alias_index = index
+            except Exception:
+                monitor.message(
+                    'diskio',
+                    'WARNING Cannot read alias index, rebuilding: %s' % path
+                )
+    return _alias_index
+
+
+def _file_stamp(file_path):
+    stat = os.stat(file_path)
+    return stat.st_size, stat.st_mtime
+
+
+def _use_alias_index(file_path):
+    return settings.alias_index_name and os.path.isfile(file_path)
+
+
+def _is_indexed(file_path):
+    if not _use_alias_index(file_path):
+        return False
+    entry = _get_alias_index().get(os.path.abspath(file_path))
+    return bool(entry) and entry[0] == _file_stamp(file_path)
+
+
+def _add_to_alias_index(file_path, stamp, content):
+    global _alias_index_changed
+    _get_alias_index()[os.path.abspath(file_path)] = stamp, content
+    _alias_index_changed = True
+
+
+def _indexed_path_and_type(file_path):
+    if not _use_alias_index(file_path):
+        root_file = get_open_root_file(file_path)
+        return list(_recursive_path_and_type(root_file, ''))
+
+    if _is_indexed(file_path):
+        return _get_alias_index()[os.path.abspath(file_path)][1]
+
+    stamp = _file_stamp(file_path)
+    root_file = get_open_root_file(file_path)
+    content = list(_recursive_path_and_type(root_file, ''))
+    _add_to_alias_index(file_path, stamp, content)
+    return content
+
+
+def _scan_in_parallel(list_of_files):
+    # scans files that are not indexed with a WorkerPool, if worth it
+    to_scan = list(collections.OrderedDict.fromkeys(
+        f for f in list_of_files if not _is_indexed(f)))
+    if (len(to_scan) < settings.alias_scan_min_files_parallel
+        or not settings.can_go_parallel()):
+        return {}
+
+    n_workers = min(settings.max_num_processes, len(to_scan))
+    scanned = {}
+    with multiproc.WorkerPool(n_workers) as pool:
+        for file_path, stamp, content in pool.imap_unordered(
+            _scan_file_in_worker,
+            to_scan,
+            costs=lambda f: os.path.getsize(f) if os.path.isfile(f) else 0,
+        ):
+            scanned[file_path] = content
+            if stamp:
+                _add_to_alias_index(file_path, stamp, content)
+    return scanned
+
+
+def _scan_file_in_worker(file_path):
+    # returns only picklable items: (str, (int, float), [(str, str)])
+    stamp = _file_stamp(file_path) if _use_alias_index(file_path) else None
+    root_file = TFile.Open(file_path, 'READ')
+    if (not root_file) or root_file.IsZombie():
+        raise RuntimeError('Cannot open file with root: "%s"' % file_path)
+    content = list(_recursive_path_and_type(root_file, ''))
+    root_file.Close()
+    return file_path, stamp, content
+
+
+def write_alias_index():
+    """Writes the alias index to disk, if it has changed."""
+    global _alias_index_changed
+    if not (_alias_index_changed and settings.alias_index_name):
+        return
+
+    # merge with entries from other processes and write to a temporary file
+    # first, as other processes might read the index at the same time
+    path = _alias_index_path()
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    index = {}
+    try:
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                index = cPickle.load(f)
+    except Exception:
+        pass
+    for key in _alias_index_dropped:
+        index.pop(key, None)
+    index.update(_alias_index)
+    try:
+        with open(tmp_path, 'wb') as f:
+            cPickle.dump(index, f, cPickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_path, path)
+    except (IOError, OSError) as e:
+        monitor.message(
+            'diskio',
+            'WARNING Cannot write alias index: %s' % str(e)
+        )
+    _alias_index_changed = False
+    _alias_index_dropped.clear()
+
+
+def invalidate_alias_index(list_of_files=None):
+    """
+    Removes files from the alias index. Without arguments, drops all entries.
+
+    :param list_of_files:   list of str, paths to root files
+    """
+    global _alias_index, _alias_index_changed
+    if list_of_files is None:
+        _alias_index = {}
+        _alias_index_changed = False
+        _alias_index_dropped.clear()
+        path = _alias_index_path()
+        if os.path.exists(path):
+            os.remove(path)
+        return
+
+    index = _get_alias_index()
+    for file_path in list_of_files:
+        key = os.path.abspath(file_path)
+        if index.pop(key, None):
+            _alias_index_dropped.add(key)
+            _alias_index_changed = True
+    write_alias_index()
+
+
+def rebuild_alias_index(list_of_files):
+    """
+    Rescans the given files and stores their content in the alias index.
+
+    :param list_of_files:   list of str, paths to root files
+    """
+    invalidate_alias_index(list_of_files)
+    for _ in generate_aliases_list(list_of_files):
+        pass
+
+
+############################################################ content digest ###
+n_skipped_writes = 0  # writes skipped, as the content on disk was the same
+
+
+def content_digest(wrp):
+    """
+    Returns a digest of the wrapper info and its root objects.
+
+    Root objects contribute with their streamed bytes (as they would be written
+    to a root file), i.e. with all their content, including labels, attached
+    functions and the primitives and draw options of pads and canvases.
+    """
+    md5 = hashlib.md5()
+    _update_digest(md5, wrp)
+    return md5.hexdigest()
+
+
+def _update_digest(md5, wrp):
+    info = wrp.all_writeable_info()
+    for key in ('io_digest', 'wrps'):
+        info.pop(key, None)
+    if 'history' in info:
+        info['history'] = str(info['history'])
+    for key in sorted(info):
+        md5.update('%s=%r;' % (key, info[key]))
+    for key in sorted(wrp.__dict__):
+        value = wrp.__dict__[key]
+        if isinstance(value, TObject):
+            md5.update(key)
+            md5.update(streamed_bytes(value))
+    if isinstance(wrp, wrappers.WrapperWrapper):
+        for w in wrp.wrps:
+            _update_digest(md5, w)
+
+
+def streamed_bytes(obj):
+    """Returns a root object serialized with its streamer (str)."""
+    buf = TBufferFile(TBuffer.kWrite)
+    buf.WriteObject(obj)
+    n_bytes = buf.Length()
+    data = array('B', '\0' * n_bytes)
+    buf.SetReadMode()
+    buf.SetBufferOffset(0)
+    buf.ReadFastArray(data, n_bytes)
+    return data.tostring()
 
 
 ########################################################## helper functions ###
@@ -230,9 +565,102 @@ def record_in_save_log(filename):
         _save_log.add(filename)
 
 
+_binary_info_magic = '\x00VARIAL_INFO\x00'
+_binary_info_version = 1
+
+
+def _load_lazy_histos(wrp):
+    if isinstance(wrp, wrappers.LazyHistoWrapper):
+        wrp.histo  # load before writing
+    elif isinstance(wrp, wrappers.WrapperWrapper):
+        for w in wrp.wrps:
+            _load_lazy_histos(w)
+
+
+def _write(wrp, filename, suffices=(), mode='RECREATE'):
+    if mode == 'RECREATE' and _is_unchanged(wrp, filename, suffices):
+        return
+    _save_images(wrp, filename, suffices)
+    _write_files(wrp, filename, mode)
+
+
+def _save_images(wrp, filename, suffices):
+    # save with suffices
+    for suffix in suffices:
+        wrp.obj.SaveAs(filename + suffix)
+
+
+def _write_files(wrp, filename, mode='RECREATE'):
+    # writes the info and root file (no graphics, may run in the background)
+    if settings.diskio_check_readability:
+        _check_readability(wrp)
+    # WrapperWrapper: store others first
+    if isinstance(wrp, wrappers.WrapperWrapper):
+        if _use_wrpwrp_container(wrp):
+            _write_wrapperwrapper_container(wrp, filename, mode)
+            mode = 'UPDATE'  # for the objects of the WrapperWrapper itself
+        else:
+            _write_wrapperwrapper(wrp, filename)
+    # write root objects (if any)
+    if any(isinstance(o, TObject) for o in wrp.__dict__.itervalues()):
+        wrp.root_filename = basename(filename+'.root')
+        f = TFile.Open(filename+'.root', mode)
+        f.cd()
+        _write_wrapper_objs(wrp, f)
+        f.Close()
+    # write wrapper infos
+    with open(filename+'.info', 'wb') as f:
+        _write_wrapper_info(wrp, f)
+    _clean_wrapper(wrp)
+
+
+def _small_write(wrp, filename, suffices=()):
+    if _is_unchanged(wrp, filename, suffices, False):
+        return
+    _write_info_only(wrp, filename)
+    for suffix in suffices:
+        wrp.obj.SaveAs(filename + suffix)
+
+
+def _write_info_only(wrp, filename):
+    with open(filename+'.info', 'wb') as f:
+        _write_wrapper_info(wrp, f)
+    _clean_wrapper(wrp)
+
+
+def _is_unchanged(wrp, filename, suffices, with_root_objs=True):
+    #"""Sets wrp.io_digest. True if the file on disk has the same digest."""
+    global n_skipped_writes
+    if not settings.io_skip_unchanged_writes:
+        return False
+    wrp.io_digest = content_digest(wrp)
+    if not os.path.exists(filename + '.info'):
+        return False
+    if not all(os.path.exists(filename + s) for s in suffices):
+        return False
+    if with_root_objs and not os.path.exists(filename + '.root') and (
+        any(isinstance(o, TObject) for o in wrp.__dict__.itervalues())
+        or (isinstance(wrp, wrappers.WrapperWrapper)
+            and _use_wrpwrp_container(wrp))
+    ):
+        return False
+    try:
+        with open(filename + '.info', 'rb') as f:
+            old_digest = _read_wrapper_info(f).get('io_digest')
+    except Exception:
+        return False
+    if old_digest != wrp.io_digest:
+        return False
+    del wrp.io_digest
+    n_skipped_writes += 1
+    return True
+
+
 def _write_wrapper_info(wrp, file_handle):
     #"""Serializes Wrapper to python code dict."""
-    if hasattr(wrp, 'history'):
+    if settings.diskio_binary_info:
+        _write_wrapper_info_binary(wrp, file_handle)
+    elif hasattr(wrp, 'history'):
         history, wrp.history = wrp.history, str(wrp.history)
         file_handle.write(wrp.pretty_writeable_lines() + ' \n\n')
         file_handle.write(wrp.history + '\n')
@@ -241,6 +669,16 @@ def _write_wrapper_info(wrp, file_handle):
         file_handle.write(wrp.pretty_writeable_lines() + ' \n\n')
 
 
+def _write_wrapper_info_binary(wrp, file_handle):
+    #"""Serializes Wrapper info with marshal, after a versioned header."""
+    info = wrp.all_writeable_info()
+    if 'history' in info:
+        info['history'] = str(info['history'])
+    file_handle.write(_binary_info_magic)
+    file_handle.write(struct.pack('<H', _binary_info_version))
+    file_handle.write(marshal.dumps(info, 2))
+
+
 def _write_wrapper_objs(wrp, file_handle):
     #"""Writes root objects on wrapper to disk."""
     wrp.root_file_obj_names = {}
@@ -264,27 +702,95 @@ def _write_wrapper_objs(wrp, file_handle):
             wrp.root_file_obj_names[key] = value.GetName()
 
 
-def _write_wrapperwrapper(wrp, filename=None):
-    global use_analysis_cwd
-    if not filename:
-        filename = wrp.name
+def _write_wrapperwrapper(wrp, filename):
     wrp_names = []
     for i, w in enumerate(wrp.wrps):
         name = filename + '_WRPWRP_%03d' % i
         wrp_names.append(basename(name))
-        with_ana_cwd = use_analysis_cwd
-        try:
-            use_analysis_cwd = False  # write should not prepend cwd again
-            write(w, name)
-        finally:
-            use_analysis_cwd = with_ana_cwd  # reset
+        record_in_save_log(name)
+        _write(copy.copy(w), name)  # members might be in use elsewhere
     wrp.wrpwrp_names = wrp_names
     wrp._wrpwrp_wrps = wrp.wrps
     del wrp.wrps
 
 
+def _read(filename):
+    info = _read_info_file(filename)
+    path = dirname(filename)
+    if 'root_file_obj_names' in info:
+        _read_wrapper_objs(info, path)
+    klass = getattr(wrappers, info.get('klass'))
+    if klass == wrappers.WrapperWrapper:
+        if 'wrpwrp_infos' in info:
+            info['wrps'] = list(
+                _read_container_member(info, path, i)
+                for i in xrange(len(info['wrpwrp_infos']))
+            )
+        else:
+            info['wrps'] = _read_wrapperwrapper(
+                join(path, f) + '.info'
+                for f in info['wrpwrp_names']
+            )
+    wrp = klass(**info)
+    _clean_wrapper(wrp)
+    return wrp
+
+
+def _read_info_file(filename):
+    with open(filename, 'rb') as f:
+        try:
+            return _read_wrapper_info(f)
+        except ValueError as e:
+            monitor.message(
+                'diskio.read',
+                'ERROR can not read info: ' + filename
+            )
+            raise e
+
+
+def _read_container_member(info, path, index):
+    member = dict(info['wrpwrp_infos'][index])
+    if 'root_file_obj_names' in member:
+        member['root_filename'] = info['root_filename']
+        _read_wrapper_objs(member, path, _wrpwrp_member_dir % index + '/')
+    wrp = getattr(wrappers, member.get('klass'))(**member)
+    _clean_wrapper(wrp)
+    return wrp
+
+
+_wrpwrp_member_dir = '_WRPWRP_%03d'
+
+
+def _use_wrpwrp_container(wrp):
+    return settings.diskio_wrpwrp_container and not any(
+        isinstance(w, wrappers.WrapperWrapper) for w in wrp.wrps)
+
+
+def _write_wrapperwrapper_container(wrp, filename, mode):
+    #"""Writes all members into one root file. Their infos go into wrp."""
+    wrp.root_filename = basename(filename+'.root')
+    f = TFile.Open(filename+'.root', mode)
+    member_infos = []
+    for i, w in enumerate(wrp.wrps):
+        w = copy.copy(w)  # members might be in use elsewhere
+        member_dir = f.mkdir(_wrpwrp_member_dir % i)
+        if any(isinstance(o, TObject) for o in w.__dict__.itervalues()):
+            _write_wrapper_objs(w, member_dir)
+        info = w.all_writeable_info()
+        if 'history' in info:
+            info['history'] = str(info['history'])
+        member_infos.append(info)
+    f.Close()
+    wrp.__dict__['wrpwrp_infos'] = member_infos  # literals: skip the check
+    wrp._wrpwrp_wrps = wrp.wrps
+    del wrp.wrps
+
+
 def _read_wrapper_info(file_handle):
     #"""Instaciates Wrapper from info file, without root objects."""
+    if file_handle.read(len(_binary_info_magic)) == _binary_info_magic:
+        return _read_wrapper_info_binary(file_handle)
+    file_handle.seek(0)
     lines = takewhile(lambda l: l!='\n', file_handle)
     lines = (l.strip() for l in lines)
     lines = ''.join(lines)
@@ -294,16 +800,33 @@ def _read_wrapper_info(file_handle):
     return info
 
 
-def _read_wrapper_objs(info, path):
+def _read_wrapper_info_binary(file_handle):
+    version, = struct.unpack('<H', file_handle.read(2))
+    if version > _binary_info_version:
+        raise NoDictInFileError(
+            'Binary info version %d is not supported (file: %s)' % (
+                version, file_handle.name))
+    try:
+        info = marshal.loads(file_handle.read())
+    except (EOFError, ValueError, TypeError):
+        raise NoDictInFileError('Could not read file: '+file_handle.name)
+    if not type(info) == dict:
+        raise NoDictInFileError('Could not read file: '+file_handle.name)
+    return info
+
+
+def _read_wrapper_objs(info, path, in_file_prefix=''):
     #"""Reads root objects from disk."""
     root_file = join(path, info['root_filename'])
     obj_paths = info['root_file_obj_names']
     is_fs_wrp = info['klass'] == 'FileServiceWrapper'
     for key, value in obj_paths.iteritems():
         if is_fs_wrp:
-            obj = _get_obj_from_file(root_file, info['name'] + '/' + value)
+            obj = _get_obj_from_file(
+                root_file, in_file_prefix + info['name'] + '/' + value)
         else:
-            obj = _get_obj_from_file(root_file, key + '/' + value)
+            obj = _get_obj_from_file(
+                root_file, in_file_prefix + key + '/' + value)
         if hasattr(obj, 'SetDirectory'):
             obj.SetDirectory(0)
         info[key] = obj
@@ -312,15 +835,17 @@ def _read_wrapper_objs(info, path):
 def _read_wrapperwrapper(wrp_list):
     wrps = []
     for fname in wrp_list:
-        wrps.append(read(fname))
+        wrps.append(_read(fname))
     return wrps
 
 
 def _clean_wrapper(wrp):
     del_attrs = ['root_filename',
                  'root_file_obj_names',
-                 'wrapped_object_key'
-                 'wrpwrp_names']
+                 'wrapped_object_key',
+                 'wrpwrp_names',
+                 'wrpwrp_infos',
+                 'io_digest']
     for attr in del_attrs:
         if hasattr(wrp, attr):
             delattr(wrp, attr)
@@ -341,16 +866,46 @@ def _check_readability(wrp):
 
 
 def _get_obj_from_file(filename, in_file_path):
-    obj = get_open_root_file(filename)
-    # browse through file
-    for name in in_file_path.split('/'):
-        obj_key = obj.GetKey(name)
-        if not obj_key:
+    # reads an object; directories on the way are cached per open file
+    root_file = get_open_root_file(filename)
+    dir_map = _dir_cache.setdefault(filename, {})
+    if '' not in dir_map:
+        dir_map[''] = root_file, _key_table(root_file)
+    dir_path, _, name = in_file_path.rpartition('/')
+    _, keys = _get_cached_dir(dir_map, dir_path, in_file_path, filename)
+    return _read_key(keys, name, in_file_path, filename)
+
+
+def _get_cached_dir(dir_map, dir_path, in_file_path, filename):
+    if dir_path not in dir_map:
+        parent_path, _, dir_name = dir_path.rpartition('/')
+        _, parent_keys = _get_cached_dir(
+            dir_map, parent_path, in_file_path, filename)
+        obj_dir = _read_key(parent_keys, dir_name, in_file_path, filename)
+        if not isinstance(obj_dir, TDirectory):
             raise NoObjectError(
-                'I cannot find "%s" in root file "%s"!' % (in_file_path,
-                                                           filename))
-        obj = obj_key.ReadObj()
-    return obj
+                'I cannot find "%s" in root file "%s"!' % (
+                    in_file_path, filename))
+        dir_map[dir_path] = obj_dir, _key_table(obj_dir)
+    return dir_map[dir_path]
+
+
+def _key_table(obj_dir):
+    # name -> key with the highest cycle (like TDirectory::GetKey)
+    keys = {}
+    for key in obj_dir.GetListOfKeys():
+        name = key.GetName()
+        if name not in keys or keys[name].GetCycle() < key.GetCycle():
+            keys[name] = key
+    return keys
+
+
+def _read_key(keys, name, in_file_path, filename):
+    obj_key = keys.get(name)
+    if not obj_key:
+        raise NoObjectError(
+            'I cannot find "%s" in root file "%s"!' % (in_file_path, filename))
+    return obj_key.ReadObj()
 
 
 def _recursive_path_and_type(root_dir, in_file_path):
@@ -374,6 +929,14 @@ def _recursive_path_and_type(root_dir, in_file_path):
 
 def _wrapperize(bare_histo, alias):
     """Returns a wrapper with a fileservice histogram."""
+    _check_histo(bare_histo, alias)
+    wrp = wrappers.HistoWrapper(bare_histo, **alias.all_info())
+    _prepare_histo(bare_histo, alias)
+    wrp.history = _alias_history(alias)
+    return wrp
+
+
+def _check_histo(bare_histo, alias):
     if not isinstance(bare_histo, TH1):
         raise NoHistogramError(
             'Loaded object is not of type TH1.\n'
@@ -381,19 +944,24 @@ def _wrapperize(bare_histo, alias):
         )
     if not bare_histo.GetSumw2().GetSize():
         bare_histo.Sumw2()
-    wrp = wrappers.HistoWrapper(bare_histo, **alias.all_info())
+
+
+def _prepare_histo(bare_histo, alias):
     if isinstance(alias, wrappers.FileServiceAlias):
         bare_histo.SetTitle(alias.legend)
-        wrp.history = history.History(
+
+
+def _alias_history(alias):
+    if isinstance(alias, wrappers.FileServiceAlias):
+        return history.History(
             'FileService(%s, %s)' % (
                 alias.in_file_path, alias.sample))
     else:
         info = alias.all_writeable_info()
         del info['klass']
-        wrp.history = history.History(
+        return history.History(
             'RootFile(%s)' % info
         )
-    return wrp
 
 
 ################################################### write and close on exit ###
@@ -419,12 +987,21 @@ def write_fileservice(filename='', initial_mode='RECREATE'):
     analysis.fs_wrappers = {}
 
 
+def _report_skipped_writes():
+    if n_skipped_writes:
+        monitor.message(
+            'diskio',
+            'INFO %d unchanged file(s) were not rewritten.' % n_skipped_writes
+        )
+
+
+atexit.register(_report_skipped_writes)
 atexit.register(write_fileservice)
+atexit.register(write_alias_index)
 atexit.register(close_open_root_files)
+atexit.register(writequeue.flush_at_exit)  # runs first (atexit is LIFO)
 
 
-# TODO read and write should only call utility methods (see ugly wrpwrp writing)
-# TODO synchronized/buffered write with multiprocessing.Manager object
 # TODO bulk_read(aliases) function => all reading en block, with possible lock
 # TODO context manager for use_analysis_cwd (maybe general util)
 # TODO get rid of use_analysis_cwd. It's bad design.
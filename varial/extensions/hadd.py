@@ -99,7 +99,11 @@ class Hadd(varial.tools.Tool):
                     for bn, fs in basename_map.iteritems())
 
         with varial.multiproc.WorkerPool(n_procs) as pool:
-            for _ in pool.imap_unordered(_handle_block, iterable):
+            for _ in pool.imap_unordered(
+                _handle_block,
+                iterable,
+                costs=lambda args: sum(os.path.getsize(f) for f in args[2]),
+            ):
                 pass
 
         # link others
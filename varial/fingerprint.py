@@ -0,0 +1,230 @@
+"""
+Fingerprints of the inputs of tools, for reuse decisions per tool.
+
+With ``settings.reuse_by_fingerprint``, a tool records its inputs while it
+runs and stores them with a digest of its result in ``.fingerprint`` in its
+directory. These inputs are:
+
+* the results it looked up with ``analysis.lookup_result`` (their digests),
+* the root files it opened with ``diskio`` and the files returned by its
+  ``input_files()`` method (their modification times),
+* the settings named in ``settings.fingerprint_settings`` and in the
+  ``fingerprint_settings`` attribute of the tool,
+* its own state after ``__init__`` (i.e. the constructor arguments, including
+  the defaults, closures and globals of functions).
+
+A tool is reused if its inputs are unchanged, no matter if tools before it were
+run. Tools without a fingerprint are reused as before (only if all tools before
+them were reused). Note that inputs other than the ones above, e.g. files that
+are read with plain python, are not seen.
+"""
+
+import hashlib
+import cPickle
+import types
+import os
+
+import settings  # init ROOT first
+import util
+import ROOT
+
+
+_filename = '.fingerprint'
+_version = 3
+_recordings = []  # one per running tool: (tool, {'args', 'lookups', 'files'})
+_volatile_attrs = set((  # tool attributes that are no constructor arguments
+    'message', 'cwd', 'result', 'logfile', 'logfile_res', 'time_start',
+    'time_fin', '_reuse',
+))
+
+
+############################################################### recording ###
+class _Recording(object):
+    def __init__(self, tool):
+        self.tool = tool
+
+    def __enter__(self):
+        if settings.reuse_by_fingerprint and hasattr(self.tool, 'input_files'):
+            _recordings.append((self.tool, {
+                'args': _args_digest(self.tool),  # before run changes it
+                'lookups': {},
+                'files': set(),
+            }))
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        _pop_recording(self.tool)  # if not done by finish, e.g. on errors
+
+
+def recording(tool):
+    """Returns a context, in which the inputs of a tool are recorded."""
+    return _Recording(tool)
+
+
+def _pop_recording(tool):
+    for i in xrange(len(_recordings) - 1, -1, -1):
+        if _recordings[i][0] is tool:
+            return _recordings.pop(i)[1]
+
+
+def record_lookup(result_path):
+    """Records a looked up result (called by ``analysis.lookup_result``)."""
+    if _recordings:
+        lookups = _recordings[-1][1]['lookups']
+        if result_path not in lookups:
+            lookups[result_path] = stored_result_digest(result_path)
+
+
+def record_file(filename):
+    """Records an input file (called by ``diskio``)."""
+    if _recordings:
+        _recordings[-1][1]['files'].add(filename)
+
+
+def finish(tool):
+    """Stops recording and stores the fingerprint in the tool directory."""
+    rec = _pop_recording(tool) or {
+        'args': _args_digest(tool), 'lookups': {}, 'files': ()}
+    fp = _current_fingerprint(tool, rec['lookups'], rec['files'], rec['args'])
+    fp['result'] = result_digest(tool.result)
+    with open(os.path.join(tool.cwd, _filename), 'wb') as f:
+        cPickle.dump(fp, f, 2)
+
+
+################################################################# digests ###
+def _load(path):
+    try:
+        with open(os.path.join(path, _filename), 'rb') as f:
+            fp = cPickle.load(f)
+    except (IOError, EOFError, ValueError, cPickle.UnpicklingError):
+        return None
+    return fp if fp.get('version') == _version else None
+
+
+def stored_result_digest(result_path):
+    """Returns the result digest stored for a tool directory (or 'unknown')."""
+    fp = _load(result_path)
+    return fp['result'] if fp else 'unknown'
+
+
+def result_digest(result):
+    """Returns a digest of a tool result."""
+    import diskio
+    import wrappers
+    if isinstance(result, wrappers.Wrapper):
+        return diskio.content_digest(result)
+    return hashlib.md5(_stable_repr(result)).hexdigest()
+
+
+def _code_repr(code):
+    return 'code(%s,%s)' % (
+        code.co_code.encode('hex'),
+        ','.join(_code_repr(c) if isinstance(c, types.CodeType) else repr(c)
+                 for c in code.co_consts),
+    )
+
+
+def _cell_contents(cell):
+    try:
+        return cell.cell_contents
+    except ValueError:
+        return None  # empty cell
+
+
+def _global_names(code):
+    names = set(code.co_names)
+    for c in code.co_consts:
+        if isinstance(c, types.CodeType):
+            names.update(_global_names(c))
+    return names
+
+
+def _stable_repr(obj, depth=0):
+    """
+    Like repr, but without memory addresses. Functions give their code, root
+    objects a digest of their streamed content.
+    """
+    if depth > 8:
+        return type(obj).__name__
+    depth += 1
+    if isinstance(obj, (basestring, int, long, float, bool, types.NoneType)):
+        return repr(obj)
+    if isinstance(obj, (list, tuple)):
+        return '[%s]' % ','.join(_stable_repr(o, depth) for o in obj)
+    if isinstance(obj, (set, frozenset)):
+        return '{%s}' % ','.join(sorted(_stable_repr(o, depth) for o in obj))
+    if isinstance(obj, dict):
+        return '{%s}' % ','.join(sorted(
+            '%s:%s' % (_stable_repr(k, depth), _stable_repr(v, depth))
+            for k, v in obj.iteritems()))
+    if isinstance(obj, types.MethodType):
+        obj = obj.im_func
+    if isinstance(obj, types.FunctionType):
+        return 'function(%s,%s,%s,%s)' % (
+            _code_repr(obj.func_code),
+            _stable_repr(obj.func_defaults, depth),
+            _stable_repr(list(_cell_contents(c)
+                              for c in obj.func_closure or ()), depth),
+            _stable_repr(dict((n, obj.func_globals[n])
+                              for n in _global_names(obj.func_code)
+                              if n in obj.func_globals), depth),
+        )
+    if isinstance(obj, (type, types.ClassType, types.ModuleType)):
+        return '%s(%s)' % (type(obj).__name__, obj.__name__)
+    name = '%s.%s' % (type(obj).__module__, type(obj).__name__)
+    if isinstance(obj, ROOT.TObject):
+        import diskio
+        return '%s(%s)' % (
+            name, hashlib.md5(diskio.streamed_bytes(obj)).hexdigest())
+    attrs = getattr(obj, '__dict__', None)
+    if attrs:
+        return '%s%s' % (name, _stable_repr(attrs, depth))
+    return name
+
+
+def _args_digest(tool):
+    # no_reset tools have no init state, their state before running is used
+    state = util._instance_init_states.get(tool) or tool.__dict__
+    state = dict((k, v) for k, v in state.iteritems()
+                 if k not in _volatile_attrs)
+    return hashlib.md5(_stable_repr(state)).hexdigest()
+
+
+def _settings_repr(tool):
+    names = set(settings.fingerprint_settings)
+    names.update(getattr(tool, 'fingerprint_settings', ()))
+    return dict((n, _stable_repr(getattr(settings, n, None))) for n in names)
+
+
+def _mtimes(filenames):
+    return dict(
+        (f, os.path.getmtime(f) if os.path.exists(f) else None)
+        for f in filenames
+    )
+
+
+def _current_fingerprint(tool, lookups, files, args_digest):
+    files = set(files)
+    files.update(tool.input_files())
+    return {
+        'version': _version,
+        'args': args_digest,
+        'settings': _settings_repr(tool),
+        'lookups': lookups,
+        'files': _mtimes(files),
+    }
+
+
+############################################################# comparison ###
+def is_unchanged(tool):
+    """
+    Compares the stored fingerprint of a tool with its current inputs.
+
+    :returns:   bool, or None if there is no fingerprint
+    """
+    fp = _load(tool.cwd)
+    if not fp:
+        return None
+    lookups = dict((p, stored_result_digest(p)) for p in fp['lookups'])
+    current = _current_fingerprint(
+        tool, lookups, fp['files'], _args_digest(tool))
+    return all(fp[k] == v for k, v in current.iteritems())
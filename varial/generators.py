@@ -587,14 +587,20 @@ def dir_content(pattern='./*.root'):
     return wrps
 
 
-def load(aliases):
+def load(aliases, lazy=False):
     """
     Loads histograms in histowrappers for aliases.
 
     :param aliases: Alias iterable
+    :param lazy:    bool, if True, histograms are only read from disk when
+                    they are accessed (see wrappers.LazyHistoWrapper)
     :yields:        HistoWrapper
     """
-    for wrp in diskio.bulk_load_histograms(aliases):
+    if lazy:
+        wrps = diskio.lazy_load_histograms(aliases)
+    else:
+        wrps = diskio.bulk_load_histograms(aliases)
+    for wrp in wrps:
         yield wrp
 
 
@@ -10,6 +10,7 @@ import os
 import time
 
 import multiproc
+import profiling
 import settings
 import analysis
 import monitor
@@ -33,7 +34,7 @@ class SigintHandler(object):
         if signal_int is signal.SIGINT:
             if not ipython_mode:
                 if self.hits:
-                    if multiproc._cpu_semaphore:
+                    if multiproc._scheduler:
                         try:
                             os.killpg(os.getpid(), signal.SIGTERM)
                         except OSError:
@@ -173,6 +174,10 @@ def main(**main_kwargs):
             )
         else:
             raise e
+    finally:
+        if settings.profiling:
+            profiling.write_report()
+            profiling.print_summary()
 
 
 #TODO grep "print " *.py and replace them with monitor
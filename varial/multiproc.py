@@ -29,14 +29,53 @@ Example usage:
 Note that in the example, the input and output data of the worker is just an
 int. If large amounts of data need to be transferred, it is better to let the
 worker store the data on disk and read it back in the host.
+
+Workers take the next item as soon as they are done, so items of different
+size are balanced automatically. If the cost of the items is known (e.g. the
+size of input files), pass it to ``imap_unordered``. Then the most expensive
+items are started first and no big item is left for the end:
+
+>>> for res in pool.imap_unordered(my_func, files, costs=os.path.getsize):
+>>>     print res
+
+The time every worker spent working is recorded. See
+``WorkerPool.utilization`` and ``settings.multiproc_report_interval``. The peak
+memory of every item is collected per tool (see ``take_item_peaks``) and
+written to the logfile of the tool.
+
+With ``settings.multiproc_memory_budget_mb``, a new item is only started if the
+resident memory of all processes below the first pool plus the largest memory
+increase of any item so far fits into the budget. An item is always started if
+no other item is running. Items that wait for a nested pool do not count as
+running. Resident memory counts pages shared after forking in every process, so
+this is a conservative estimate.
+
+With ``settings.multiproc_persistent_pool``, the first pool starts
+``settings.max_num_processes`` worker processes that live until the end of the
+program. All later pools, also nested ones, are facades that send their items
+to these workers instead of forking again. An item is run in the context
+(tool stack, cwd) of the tool that submitted it. Workers that wait for their
+own items meanwhile work on other items. Note that the workers are copies of
+the process at the time the first pool is created: results of tools that ran
+later are read from disk on lookup, but other changes (e.g. to the analysis
+module) are not seen by the workers.
 """
 
 import multiprocessing.pool
 import settings
+import monitor
+import atexit
+import Queue
+import time
 import sys
-
-_cpu_semaphore = None
-_traceback_printlock = None  # this is never released (only print once)
+import os
+
+_scheduler = None  # shared between all processes, see _Scheduler
+_in_persistent_worker = False
+_n_items_here = 0  # items running in this process (and counted in n_running)
+_suspended_items = []  # per nested pool: True if an item stopped counting
+_warned_memory = False
+_item_peaks = {}  # tool path -> peak memory of every pool item in MB
 pre_fork_cbs = []
 pre_join_cbs = []
 
@@ -52,7 +91,7 @@ def _catch_exception_in_worker(func, *args, **kws):
 
     except Exception as e:
         res = 'Exception', e
-        if _traceback_printlock.acquire(block=False):
+        if _scheduler.traceback_printlock.acquire(block=False):
             import traceback
             tb = ''.join(traceback.format_exception(*sys.exc_info()))
             print '='*80
@@ -74,11 +113,366 @@ def _gen_raise_exception_in_host(iterator):
             yield i
 
 
-def _exec_in_worker(func_and_item):
-    """parallel execution with cpu control and exception catching."""
+def _exec_in_worker_timed(func_and_item):
+    """
+    parallel execution with cpu control and exception catching.
+
+    Returns (pid, busy seconds, peak memory in MB, result).
+    """
+
+    with _scheduler.cpu_semaphore:
+        busy_time, peak_rss, res = _exec_admitted(func_and_item)
+        return os.getpid(), busy_time, peak_rss, res
+
+
+def _exec_admitted(func_and_item):
+    global _n_items_here
+    _wait_for_memory()
+    _n_items_here += 1
+    try:
+        rss_start = rss_mb()
+        reset_peak_rss()
+        time_start = time.time()
+        res = _catch_exception_in_worker(*func_and_item)
+        busy_time = time.time() - time_start
+        peak_rss = peak_rss_mb()
+        max_item_rss = _scheduler.max_item_rss
+        with max_item_rss.get_lock():
+            max_item_rss.value = max(max_item_rss.value, peak_rss - rss_start)
+        return busy_time, peak_rss, res
+    finally:
+        _n_items_here -= 1
+        with _scheduler.n_running.get_lock():
+            _scheduler.n_running.value -= 1
+
+
+def _suspend_item():
+    # an item that waits for a nested pool must not hold back its children
+    global _n_items_here
+    suspend = _n_items_here > 0
+    if suspend:
+        _n_items_here -= 1
+        with _scheduler.n_running.get_lock():
+            _scheduler.n_running.value -= 1
+    _suspended_items.append(suspend)
+
+
+def _resume_item():
+    global _n_items_here
+    if _suspended_items.pop():
+        _n_items_here += 1
+        with _scheduler.n_running.get_lock():
+            _scheduler.n_running.value += 1
+
+
+def _wait_for_memory():
+    global _warned_memory
+    n_running = _scheduler.n_running
+    while True:
+        with n_running.get_lock():
+            budget = settings.multiproc_memory_budget_mb
+            if (not budget
+                or not n_running.value
+                or tree_rss_mb(_scheduler.root_pid)
+                    + _scheduler.max_item_rss.value <= budget):
+                n_running.value += 1
+                return
+        if not _warned_memory:
+            _warned_memory = True
+            monitor.message(
+                'multiproc',
+                'INFO holding back work: memory budget of %g MB reached' %
+                budget
+            )
+        time.sleep(1.)
+
+
+################################################################ memory use ###
+_page_mb = (os.sysconf('SC_PAGE_SIZE') / 2.**20
+            if hasattr(os, 'sysconf') else 0.)
+
+
+def _read_proc(path):
+    try:
+        with open(path) as f:
+            return f.read()
+    except IOError:
+        return ''  # no procfs or process is gone
+
+
+def rss_mb(pid='self'):
+    """Resident memory of a process in MB (0 without procfs)."""
+    statm = _read_proc('/proc/%s/statm' % pid).split()
+    return int(statm[1]) * _page_mb if statm else 0.
+
+
+def tree_rss_mb(pid=None):
+    """Resident memory of a process and all its descendants in MB."""
+    pid = pid or os.getpid()
+    children = {}  # ppid -> list of (pid, rss)
+    for p in os.listdir('/proc') if os.path.isdir('/proc') else ():
+        if not p.isdigit():
+            continue
+        fields = _read_proc('/proc/%s/stat' % p).rpartition(')')[2].split()
+        if len(fields) > 21:  # fields[1]: ppid, fields[21]: rss in pages
+            children.setdefault(int(fields[1]), []).append(
+                (int(p), int(fields[21]) * _page_mb))
+    total, todo = rss_mb(pid), [pid]
+    while todo:
+        for child, rss in children.get(todo.pop(), ()):
+            total += rss
+            todo.append(child)
+    return total
+
+
+def reset_peak_rss():
+    """Resets the peak resident memory of this process (Linux only)."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except IOError:
+        pass
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process since start or reset in MB."""
+    for line in _read_proc('/proc/self/status').splitlines():
+        if line.startswith('VmHWM:'):
+            return int(line.split()[1]) / 1024.
+    return 0.
+
+
+################################################################# scheduler ###
+class _Scheduler(object):
+    """
+    State that is shared by all pools: cpu semaphore and memory accounting.
+
+    Created by the outermost pool and inherited by all forked processes.
+    """
+    persistent = False
+
+    def __init__(self):
+        self.cpu_semaphore = multiprocessing.BoundedSemaphore(
+            settings.max_num_processes)
+        self.traceback_printlock = multiprocessing.RLock()  # never released
+        self.n_running = multiprocessing.Value('i', 0)
+        self.max_item_rss = multiprocessing.Value('d', 0.)
+        self.root_pid = os.getpid()
+
+    def enter_pool(self):
+        # process with pool is supposed to be waiting a lot
+        self.cpu_semaphore.release()
+
+    def leave_pool(self):
+        # must re-acquire before leaving
+        self.cpu_semaphore.acquire()
+
 
-    with _cpu_semaphore:
-        return _catch_exception_in_worker(*func_and_item)
+class _PersistentScheduler(_Scheduler):
+    """Long-lived worker processes with one queue for all items."""
+    persistent = True
+
+    def __init__(self):
+        for func in pre_fork_cbs:  # before the manager process is forked
+            func()
+        super(_PersistentScheduler, self).__init__()
+        self.manager = multiprocessing.Manager()
+        self.tasks = multiprocessing.Queue()
+        self.workers = list(
+            NoDaemonProcess(target=_serve, args=(self,))
+            for _ in xrange(settings.max_num_processes)
+        )
+        for worker in self.workers:
+            worker.start()
+
+    def enter_pool(self):
+        pass  # the number of workers is fixed
+
+    def leave_pool(self):
+        pass
+
+    def submit(self, result_queue, key, func_and_args):
+        import analysis
+        tool_path = analysis.get_current_tool_path()
+        self.tasks.put((result_queue, key, func_and_args, tool_path))
+
+    def wait(self, result_queue, helping):
+        """Returns the next result. Works on other items while waiting."""
+        while True:
+            try:
+                return result_queue.get(True, 0.05 if helping else 1e9)
+            except Queue.Empty:
+                pass
+            if helping:
+                try:
+                    task = self.tasks.get(False)
+                except Queue.Empty:
+                    continue
+                if task is None:
+                    self.tasks.put(None)  # not for me, pass on
+                    continue
+                _exec_task(task)
+
+    def shutdown(self):
+        for _ in self.workers:
+            self.tasks.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.manager.shutdown()
+
+
+def _serve(scheduler):
+    global _scheduler, _in_persistent_worker
+    _scheduler = scheduler
+    _in_persistent_worker = True
+    import analysis
+    analysis.proxies_from_disk = True
+    while True:
+        task = scheduler.tasks.get()
+        if task is None:
+            break
+        try:
+            _exec_task(task)
+        except Exception as e:  # e.g. the result queue is gone
+            monitor.message(
+                'multiproc', 'WARNING persistent worker: %s' % e)
+
+
+def _exec_task(task):
+    import analysis
+    result_queue, key, func_and_args, tool_path = task
+    busy_time, peak_rss = 0., 0.
+    try:
+        state = _switch_to_tool_path(tool_path)
+        try:
+            busy_time, peak_rss, res = _exec_admitted(func_and_args)
+        finally:
+            if state:
+                analysis.restore_tool_path(state)
+    except Exception as e:  # always answer, or the host waits forever
+        res = 'Exception', e
+    try:
+        result_queue.put((key, os.getpid(), busy_time, peak_rss, res))
+    except Exception as e:  # e.g. result cannot be pickled
+        result_queue.put((key, os.getpid(), busy_time, peak_rss, (
+            'Exception', RuntimeError('Cannot send result: %s' % e))))
+
+
+def _switch_to_tool_path(tool_path):
+    import analysis
+    if not tool_path:
+        return None
+    try:
+        return analysis.switch_to_tool_path(tool_path)
+    except KeyError:
+        raise RuntimeError(
+            'Tool path unknown in persistent worker: %s. The pool was created '
+            'before this tool existed (call multiproc.close_persistent_pool() '
+            'after adding tools).' % tool_path
+        )
+
+
+def _enter_pool():
+    """Returns True if the scheduler was created."""
+    global _scheduler
+    if _scheduler:
+        _scheduler.enter_pool()
+        _suspend_item()
+        return False
+    _scheduler = _Scheduler()
+    return True
+
+
+def _leave_pool(created_scheduler):
+    global _scheduler
+    if created_scheduler:
+        _scheduler = None
+    else:
+        _resume_item()
+        _scheduler.leave_pool()
+
+
+def _get_persistent_scheduler():
+    global _scheduler
+    if not _scheduler:
+        _scheduler = _PersistentScheduler()
+    return _scheduler
+
+
+def close_persistent_pool():
+    """
+    Stops the workers of the persistent pool (done at exit).
+
+    The next pool starts new workers, which see the current state.
+    """
+    global _scheduler
+    if _scheduler and _scheduler.persistent and not _in_persistent_worker:
+        _scheduler.shutdown()
+        _scheduler = None
+
+
+atexit.register(close_persistent_pool)
+
+
+def take_item_peaks(tool_path):
+    """Returns and forgets the peak memory (MB) of all items of a tool."""
+    return _item_peaks.pop(tool_path, [])
+
+
+def _sorted_by_costs(iterable, costs):
+    if costs is None:
+        return iterable
+    items = list(iterable)
+    if callable(costs):
+        costs = map(costs, items)
+    order = sorted(xrange(len(items)), key=lambda i: -costs[i])
+    return (items[i] for i in order)
+
+
+class _UtilizationMixin(object):
+    def _init_utilization(self):
+        self.busy_times = {}  # worker pid -> seconds
+        self.item_peaks = []  # peak memory of every item in MB
+        self.time_start = time.time()
+        self._time_last_report = self.time_start
+
+    def _record_item(self, pid, busy_time, peak_rss):
+        self.item_peaks.append(peak_rss)
+        self.busy_times[pid] = self.busy_times.get(pid, 0.) + busy_time
+        interval = settings.multiproc_report_interval
+        if interval and time.time() - self._time_last_report > interval:
+            self._report_utilization()
+
+    def _store_item_peaks(self):
+        import analysis
+        tool_path = analysis.get_current_tool_path()
+        _item_peaks.setdefault(tool_path, []).extend(self.item_peaks)
+        self.item_peaks = []
+
+    def utilization(self):
+        """
+        Returns the fraction of time, that every worker was busy so far.
+
+        :returns:   dict(worker pid => float)
+        """
+        wall_time = (time.time() - self.time_start) or 1.
+        return dict(
+            (pid, busy_time / wall_time)
+            for pid, busy_time in self.busy_times.iteritems()
+        )
+
+    def _report_utilization(self):
+        self._time_last_report = time.time()
+        fractions = self.utilization()
+        monitor.message(
+            'multiproc',
+            'INFO worker utilization: %s (mean: %.0f%% of %d workers)' % (
+                ', '.join('%d: %.0f%%' % (pid, 100. * u)
+                          for pid, u in sorted(fractions.iteritems())),
+                100. * sum(fractions.itervalues()) / self._processes,
+                self._processes,
+            )
+        )
 
 
 ################################ special worker-pool to allow for recursion ###
@@ -98,28 +492,25 @@ class NoDaemonProcess(multiprocessing.Process):
             exit(-1)
 
 
-class WorkerPool(multiprocessing.pool.Pool):
+class WorkerPool(multiprocessing.pool.Pool, _UtilizationMixin):
     Process = NoDaemonProcess
 
-    def __init__(self, *args, **kws):
-        global _cpu_semaphore, _traceback_printlock
+    def __new__(cls, *args, **kws):
+        if (settings.multiproc_persistent_pool
+                and (not _scheduler or _scheduler.persistent)):
+            return _PersistentPool(*args, **kws)
+        return super(WorkerPool, cls).__new__(cls)
 
+    def __init__(self, *args, **kws):
         # prepare parallelism (only once for the all processes)
-        self.me_created_semaphore = False
-        if _cpu_semaphore:
-            # process with pool is supposed to be waiting a lot
-            _cpu_semaphore.release()
-        else:
-            self.me_created_semaphore = True
-            n_procs = settings.max_num_processes
-            _cpu_semaphore = multiprocessing.BoundedSemaphore(n_procs)
-            _traceback_printlock = multiprocessing.RLock()
+        self.me_created_semaphore = _enter_pool()
 
         for func in pre_fork_cbs:
             func()
 
         # go parallel
         super(WorkerPool, self).__init__(*args, **kws)
+        self._init_utilization()
 
     def __enter__(self):
         return self
@@ -128,25 +519,136 @@ class WorkerPool(multiprocessing.pool.Pool):
         self.close()
         self.join()
 
-    def imap_unordered(self, func, iterable, chunksize=1):
-        iterable = ((func, i) for i in iterable)
+    def imap_unordered(self, func, iterable, chunksize=1, costs=None):
+        """
+        As in multiprocessing, with exceptions raised in the host.
+
+        :param costs:   list of numbers (cost per item, same order as
+                        iterable) or function that returns the cost of an item.
+                        If given, items are started in the order of decreasing
+                        cost (longest first).
+        """
+        iterable = ((func, i) for i in _sorted_by_costs(iterable, costs))
         res = super(WorkerPool, self).imap_unordered(
-            _exec_in_worker, iterable, chunksize
+            _exec_in_worker_timed, iterable, chunksize
         )
+        res = self._gen_record_items(res)
         res = _gen_raise_exception_in_host(res)
         return res
 
-    def close(self):
-        global _cpu_semaphore, _traceback_printlock
+    def _gen_record_items(self, iterator):
+        for pid, busy_time, peak_rss, res in iterator:
+            self._record_item(pid, busy_time, peak_rss)
+            yield res
 
+    def apply_async(self, func, args=(), kwds={}, callback=None):
+        """
+        As in multiprocessing, but exceptions are passed as result.
+
+        Results are only passed to the callback (see wait_for_callback).
+        """
+        assert not kwds, 'keywords are not supported'
+
+        def record_item(timed_res):
+            pid, busy_time, peak_rss, res = timed_res
+            self._record_item(pid, busy_time, peak_rss)
+            if callback:
+                callback(res)
+
+        return super(WorkerPool, self).apply_async(
+            _exec_in_worker_timed, ((func,) + tuple(args),),
+            callback=record_item
+        )
+
+    def wait_for_callback(self, queue):
+        """Returns the next item of a queue, that is filled by callbacks."""
+        return queue.get(True, 1e9)  # timeout: allow for SIGINT
+
+    def close(self):
         for func in pre_join_cbs:
             func()
 
-        if self.me_created_semaphore:
-            _cpu_semaphore = None
-            _traceback_printlock = None
-        else:
-            # must re-acquire before leaving
-            _cpu_semaphore.acquire()
+        if settings.multiproc_report_interval and self.busy_times:
+            self._report_utilization()
+        self._store_item_peaks()
 
+        _leave_pool(self.me_created_semaphore)
         super(WorkerPool, self).close()
+
+
+class _PersistentPool(_UtilizationMixin):
+    """WorkerPool interface for the persistent scheduler (see module doc)."""
+
+    def __init__(self, processes=None, *args, **kws):
+        self.scheduler = _get_persistent_scheduler()
+        self._processes = len(self.scheduler.workers)
+        self._init_utilization()
+        self.results = self.scheduler.manager.Queue()
+        self.callbacks = {}
+        self.outstanding = set()
+        self.n_keys = 0
+        _suspend_item()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        self.join()
+
+    def _submit(self, func_and_args, callback=None):
+        key = self.n_keys
+        self.n_keys += 1
+        if callback:
+            self.callbacks[key] = callback
+        self.outstanding.add(key)
+        self.scheduler.submit(self.results, key, func_and_args)
+        return key
+
+    def _next_result(self):
+        key, pid, busy_time, peak_rss, res = self.scheduler.wait(
+            self.results, _in_persistent_worker)
+        self.outstanding.discard(key)
+        self._record_item(pid, busy_time, peak_rss)
+        if key in self.callbacks:
+            self.callbacks.pop(key)(res)
+        return key, res
+
+    def imap_unordered(self, func, iterable, chunksize=1, costs=None):
+        """See WorkerPool.imap_unordered."""
+        keys = set(self._submit((func, i))
+                   for i in _sorted_by_costs(iterable, costs))
+        return _gen_raise_exception_in_host(self._gen_results(keys))
+
+    def _gen_results(self, keys):
+        while keys:
+            key, res = self._next_result()
+            if key in keys:
+                keys.remove(key)
+                yield res
+
+    def apply_async(self, func, args=(), kwds={}, callback=None):
+        """See WorkerPool.apply_async. Call wait_for_callback to get results."""
+        assert not kwds, 'keywords are not supported'
+        self._submit((func,) + tuple(args), callback)
+
+    def wait_for_callback(self, queue):
+        """Returns the next item of a queue, that is filled by callbacks."""
+        while queue.empty():
+            self._next_result()
+        return queue.get()
+
+    def close(self):
+        while self.outstanding:  # as join does in multiprocessing
+            self._next_result()
+        _resume_item()
+
+        for func in pre_join_cbs:
+            func()
+
+        if settings.multiproc_report_interval and self.busy_times:
+            self._report_utilization()
+        self._store_item_peaks()
+
+    def join(self):
+        pass
@@ -0,0 +1,252 @@
+"""
+Plain data representation of wrappers for the pickle based io modules.
+
+PyROOT pickles histograms by streaming them into a TBufferFile. ``encode``
+replaces the histograms in a wrapper with their bin arrays (contents, sumw2,
+edges) as raw strings, plus metadata (titles, draw option, style, bits, and
+range and attributes of all axes). ``decode`` builds the histograms from these
+buffers directly. Objects, that are not supported (e.g. histograms with fit
+functions, bin labels, contours or a fill buffer, profiles, graphs), are left
+to pickle.
+
+``decode`` returns everything it does not know as it is, so data that was
+stored before can still be read.
+"""
+
+import settings  # init ROOT first
+from ROOT import TH1
+from array import array
+import importlib
+import ROOT
+
+import wrappers
+
+
+_wrp_tag = 'varial-payload'
+_histo_tag = 'varial-histo'
+_version = 2
+_typecodes = {'D': 'd', 'F': 'f', 'I': 'i'}
+_cell_bytes = {'D': 8, 'F': 4, 'I': 4, 'S': 2, 'C': 1}
+_supported = set(
+    'TH%d%s' % (dim, t) for dim in (1, 2, 3) for t in _typecodes)
+_bit_mask = 0x00ffffc6  # TObject::kBitMask without ownership and references
+_axis_attrs = (  # Get<attr> and Set<attr> of TAxis
+    'Title', 'Ndivisions', 'AxisColor', 'LabelColor', 'LabelFont',
+    'LabelOffset', 'LabelSize', 'TickLength', 'TitleOffset', 'TitleSize',
+    'TitleColor', 'TitleFont', 'TimeDisplay', 'TimeFormat',
+)
+
+
+def encode(obj):
+    """Returns a picklable representation of a wrapper (others as they are)."""
+    if not isinstance(obj, wrappers.WrapperBase):
+        return obj
+    getstate = getattr(obj, '__getstate__', None)
+    state = getstate() if getstate else obj.__dict__
+    return (
+        _wrp_tag,
+        _version,
+        type(obj).__module__,
+        type(obj).__name__,
+        dict((k, _encode_value(v)) for k, v in state.iteritems()),
+    )
+
+
+def decode(obj):
+    """Builds wrappers and histograms from the output of ``encode``."""
+    if not (_has_tag(obj, _wrp_tag) or _has_tag(obj, _histo_tag)):
+        return obj
+    if obj[1] > _version:
+        raise RuntimeError('Payload version %d is not supported.' % obj[1])
+    if obj[0] == _histo_tag:
+        return _decode_histo(obj[2])
+    tag, version, module, klass, state = obj
+    cls = getattr(importlib.import_module(module), klass)
+    wrp = cls.__new__(cls)
+    wrp.__dict__.update(
+        (k, _decode_value(v)) for k, v in state.iteritems())
+    return wrp
+
+
+def estimate_size(obj):
+    """
+    Returns a lower bound of the size of an encoded wrapper in bytes.
+
+    Only the bin arrays of histograms are counted, without encoding anything.
+    """
+    if not isinstance(obj, wrappers.WrapperBase):
+        return 0
+    size = 0
+    for value in obj.__dict__.itervalues():
+        if isinstance(value, TH1):
+            size += (value.GetSize()
+                     * _cell_bytes.get(value.ClassName()[-1], 8))
+            size += value.GetSumw2N() * 8
+        elif _is_wrp_list(value):
+            size += sum(estimate_size(w) for w in value)
+    return size
+
+
+def _has_tag(obj, tag):
+    return type(obj) is tuple and len(obj) > 2 and obj[0] == tag
+
+
+def _encode_value(value):
+    if isinstance(value, TH1):
+        return _encode_histo(value)
+    if _is_wrp_list(value):
+        return list(encode(w) for w in value)
+    return value
+
+
+def _decode_value(value):
+    if type(value) is list and value and _has_tag(value[0], _wrp_tag):
+        return list(decode(v) for v in value)
+    return decode(value)
+
+
+def _is_wrp_list(value):
+    return (type(value) is list and value
+            and all(isinstance(w, wrappers.WrapperBase) for w in value))
+
+
+################################################################ histograms ###
+def _axes(histo):
+    return (histo.GetXaxis(), histo.GetYaxis(), histo.GetZaxis()
+            )[:histo.GetDimension()]
+
+
+def _all_axes(histo):
+    return histo.GetXaxis(), histo.GetYaxis(), histo.GetZaxis()
+
+
+def _has_modified_labels(axis):
+    labels = getattr(axis, 'GetModifiedLabels', lambda: None)()  # ROOT 6
+    return bool(labels and labels.GetSize())
+
+
+def _is_supported(histo):
+    return (histo.ClassName() in _supported
+            and not histo.GetListOfFunctions().GetSize()
+            and not histo.GetBufferSize()
+            and not histo.GetNormFactor()
+            and not histo.GetContour()
+            and not any(ax.GetLabels() or _has_modified_labels(ax)
+                        for ax in _all_axes(histo)))
+
+
+def _buffer_str(buf, typecode, size):
+    buf.SetSize(size)  # PyROOT buffers come without size
+    return array(typecode, buf).tostring()
+
+
+def _encode_axis(axis):
+    return dict(
+        attrs=tuple(getattr(axis, 'Get' + a)() for a in _axis_attrs),
+        range=(axis.GetFirst(), axis.GetLast()),
+        bits=axis.TestBits(_bit_mask),
+    )
+
+
+def _decode_axis(axis, rec):
+    for attr, value in zip(_axis_attrs, rec['attrs']):
+        getattr(axis, 'Set' + attr)(value)
+    axis.SetRange(*rec['range'])
+    axis.ResetBit(_bit_mask)
+    axis.SetBit(rec['bits'])
+
+
+def _encode_histo(histo):
+    if not _is_supported(histo):
+        return histo  # pickle
+
+    typecode = _typecodes[histo.ClassName()[-1]]
+    axes = _axes(histo)
+    n_cells = 1
+    axes_info = []
+    for ax in axes:
+        n_bins = ax.GetNbins()
+        n_cells *= n_bins + 2
+        bins = ax.GetXbins()
+        if bins.GetSize():
+            binning = n_bins, _buffer_str(bins.GetArray(), 'd', bins.GetSize())
+        else:
+            binning = n_bins, ax.GetXmin(), ax.GetXmax()
+        axes_info.append((binning, ax.GetTitle()))
+
+    sumw2 = histo.GetSumw2()
+    stats = array('d', [0.] * 13)
+    histo.GetStats(stats)
+    return _histo_tag, _version, dict(
+        klass=histo.ClassName(),
+        name=histo.GetName(),
+        title=histo.GetTitle(),
+        axes=axes_info,
+        contents=_buffer_str(histo.GetArray(), typecode, n_cells),
+        sumw2=(_buffer_str(sumw2.GetArray(), 'd', sumw2.GetSize())
+               if sumw2.GetSize() else ''),
+        stats=stats.tostring(),
+        entries=histo.GetEntries(),
+        min_max=(histo.GetMinimumStored(), histo.GetMaximumStored()),
+        style=(
+            histo.GetLineColor(), histo.GetLineStyle(), histo.GetLineWidth(),
+            histo.GetFillColor(), histo.GetFillStyle(),
+            histo.GetMarkerColor(), histo.GetMarkerStyle(),
+            histo.GetMarkerSize(),
+        ),
+        option=histo.GetOption(),
+        bar=(histo.GetBarWidth(), histo.GetBarOffset()),
+        bits=histo.TestBits(_bit_mask),
+        all_axes=list(_encode_axis(ax) for ax in _all_axes(histo)),
+    )
+
+
+def _decode_histo(rec):
+    args = [rec['name'], rec['title']]
+    for binning, _ in rec['axes']:
+        if len(binning) == 2:
+            args += [binning[0], array('d', binning[1])]  # variable bins
+        else:
+            args += list(binning)
+    histo = getattr(ROOT, rec['klass'])(*args)
+    histo.SetDirectory(0)
+
+    typecode = _typecodes[rec['klass'][-1]]
+    contents = array(typecode, rec['contents'])
+    histo.Set(len(contents), contents)
+    if rec['sumw2']:
+        sumw2 = array('d', rec['sumw2'])
+        histo.Sumw2()
+        histo.GetSumw2().Set(len(sumw2), sumw2)
+    histo.PutStats(array('d', rec['stats']))
+    histo.SetEntries(rec['entries'])
+    if not rec['sumw2'] and histo.GetSumw2N():
+        # created with TH1::SetDefaultSumw2: sumw2 from the contents, as if
+        # the histogram was filled with the default on
+        histo.Sumw2(False)
+        histo.Sumw2()
+
+    for ax, (_, title) in zip(_axes(histo), rec['axes']):
+        ax.SetTitle(title)
+    histo.SetMinimum(rec['min_max'][0])
+    histo.SetMaximum(rec['min_max'][1])
+    (line_color, line_style, line_width, fill_color, fill_style,
+     marker_color, marker_style, marker_size) = rec['style']
+    histo.SetLineColor(line_color)
+    histo.SetLineStyle(line_style)
+    histo.SetLineWidth(line_width)
+    histo.SetFillColor(fill_color)
+    histo.SetFillStyle(fill_style)
+    histo.SetMarkerColor(marker_color)
+    histo.SetMarkerStyle(marker_style)
+    histo.SetMarkerSize(marker_size)
+
+    if 'all_axes' in rec:  # since version 2
+        histo.SetOption(rec['option'])
+        histo.SetBarWidth(rec['bar'][0])
+        histo.SetBarOffset(rec['bar'][1])
+        for ax, ax_rec in zip(_all_axes(histo), rec['all_axes']):
+            _decode_axis(ax, ax_rec)
+        histo.ResetBit(_bit_mask)
+        histo.SetBit(rec['bits'])
+    return histo
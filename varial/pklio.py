@@ -2,6 +2,7 @@
 Store wrappers into a pkl object for every directory.
 
 Please checkout the :ref:`diskio-module` documentation for more information.
+Histograms are stored as raw bin arrays (see :ref:`payload-module`).
 """
 
 import cPickle
@@ -9,6 +10,7 @@ import os
 
 import analysis
 import monitor
+import payload
 
 
 _current_path = ''
@@ -79,7 +81,7 @@ def write(wrp, name=None):
     global _current_pack, _changed
     _sync(os.path.dirname(name or '_'))
     _changed = True
-    _current_pack[name or wrp.name] = wrp
+    _current_pack[name or wrp.name] = payload.encode(wrp)
 
 
 def read(name):
@@ -87,7 +89,7 @@ def read(name):
     _sync(os.path.dirname(name))
     wrp = _current_pack.get(os.path.basename(name))
     if wrp:
-        return wrp
+        return payload.decode(wrp)
     else:
         raise RuntimeError('Data not found in: %s' % _current_path)
 
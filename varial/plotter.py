@@ -9,6 +9,7 @@ import toolinterface
 import rendering
 import analysis
 import settings
+import writequeue
 import sparseio
 import monitor
 import util
@@ -400,6 +401,7 @@ class RootFilePlotter(toolinterface.ToolChainParallel):
                     os.remove(logfile)
                 self._private_plotter.run()
                 self._private_plotter._write_result()
+                writequeue.flush(analysis.get_current_tool_path())
                 with open(logfile, 'w') as f:
                     f.write('plotter done.\n')
         if self._is_base_instance:
@@ -0,0 +1,169 @@
+"""
+Timing, memory and io records for every tool.
+
+With ``settings.profiling``, ``ToolChain._run_tool`` measures every tool and
+toolchain: wall time, cpu time (of the process and of its finished child
+processes), peak resident memory (tools only) and the bytes read from and
+written to storage (from ``/proc/self/io``). Tools that run in worker
+processes send their records to the host with their results.
+
+With ``settings.profiling_cprofile``, tools are also run with cProfile and the
+stats are stored as ``<tool name>.prof`` in the tool directory, e.g. for
+``python -m pstats``.
+
+At the end of ``main.main``, the records are written to
+``settings.profiling_report`` in the working directory (json) and the slowest
+tools are printed.
+"""
+
+import cProfile
+import json
+import time
+import os
+
+import settings
+import analysis
+import multiproc
+
+
+records = []  # list of dicts, see _Measurement
+_profiler_active = False
+
+
+def _read_io():
+    try:
+        with open('/proc/self/io') as f:
+            fields = dict(line.split(':') for line in f)
+    except IOError:
+        return None
+    return int(fields['read_bytes']), int(fields['write_bytes'])
+
+
+def _cpu_times():
+    t = os.times()
+    return t[0] + t[1], t[2] + t[3]
+
+
+class _Measurement(object):
+    """Measures a tool while its block is run. Set ``reused`` if it was."""
+
+    def __init__(self, tool, enabled):
+        self.tool = tool
+        self.enabled = enabled
+        self.reused = False
+        self.profiler = None
+
+    def __enter__(self):
+        global _profiler_active
+        if not self.enabled:
+            return self
+        self.is_tool = hasattr(self.tool, 'result')  # not a ToolChain
+        self.path = analysis.get_current_tool_path()
+        self.cwd = analysis.cwd
+        self.io_start = _read_io()
+        self.cpu_start = _cpu_times()
+        self.wall_start = time.time()
+        if settings.profiling_cprofile and self.is_tool and not _profiler_active:
+            _profiler_active = True
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        global _profiler_active
+        if not self.enabled:
+            return
+        wall_time = time.time() - self.wall_start
+        cpu, cpu_children = _cpu_times()
+        io = _read_io()
+        prof_file = None
+        if self.profiler:
+            self.profiler.disable()
+            _profiler_active = False
+            if not self.reused:
+                prof_file = os.path.join(self.cwd, '%s.prof' % self.tool.name)
+                self.profiler.dump_stats(prof_file)
+
+        records.append({
+            'path': self.path,
+            'class': self.tool.__class__.__name__,
+            'is_tool': self.is_tool,
+            'pid': os.getpid(),
+            'reused': self.reused,
+            'failed': exc_type is not None,
+            'wall_s': wall_time,
+            'cpu_s': cpu - self.cpu_start[0],
+            'cpu_children_s': cpu_children - self.cpu_start[1],
+            'peak_rss_mb': (multiproc.peak_rss_mb()
+                            if self.is_tool and not self.reused else None),
+            'read_bytes': io and self.io_start and io[0] - self.io_start[0],
+            'write_bytes': io and self.io_start and io[1] - self.io_start[1],
+            'cprofile': prof_file,
+        })
+
+
+def measure(tool):
+    """
+    Returns a context, in which a tool is measured if profiling is enabled.
+
+    Must be entered after the tool is pushed (within ``with tool:``).
+    """
+    return _Measurement(tool, settings.profiling)
+
+
+def mark():
+    """Returns a mark to take the records of this process from."""
+    return len(records)
+
+
+def take_since(mark_):
+    """Removes and returns the records since mark (e.g. to send them)."""
+    res = records[mark_:]
+    del records[mark_:]
+    return res
+
+
+def add(new_records):
+    """Adds records from other processes."""
+    records.extend(new_records)
+
+
+def write_report(filename=None):
+    """
+    Writes all records as json.
+
+    :param filename:    str, default: ``settings.profiling_report`` in the
+                        working directory
+    """
+    filename = filename or os.path.join(
+        settings.varial_working_dir, settings.profiling_report)
+    with open(filename, 'w') as f:
+        json.dump({
+            'created': time.ctime(),
+            'records': sorted(records, key=lambda r: r['path']),
+        }, f, indent=1, sort_keys=True)
+
+
+def print_summary(n_tools=10):
+    """Prints the slowest tools (without toolchains)."""
+    tools = sorted((r for r in records if r['is_tool']),
+                   key=lambda r: -r['wall_s'])[:n_tools]
+    if not tools:
+        return
+
+    def mb(n_bytes):
+        return '%9.1f' % (n_bytes / 2.**20) if n_bytes is not None else ' ' * 9
+
+    print '='*80
+    print 'Slowest tools (wall s, cpu s, peak MB, read MB, written MB, path):'
+    for r in tools:
+        print '%8.1f %8.1f %9s %s %s  %s%s' % (
+            r['wall_s'],
+            r['cpu_s'] + r['cpu_children_s'],
+            '%.1f' % r['peak_rss_mb'] if r['peak_rss_mb'] else '',
+            mb(r['read_bytes']),
+            mb(r['write_bytes']),
+            r['path'],
+            ' (reused)' if r['reused'] else '',
+        )
+    print '='*80
@@ -16,8 +16,13 @@ import os
 recieved_sigint = False
 only_reload_results = False
 diskio_check_readability = False
+diskio_binary_info = False  # write .info files in the compact binary format
+diskio_wrpwrp_container = False  # WrapperWrapper in one .info and one .root
 varial_working_dir = './'
 db_name = '.varial.db'
+db_timeout = 60.  # seconds to wait for a locked database
+alias_index_name = '.varial_aliases.idx'  # set to '' to disable the index
+alias_scan_min_files_parallel = 16  # scan root files in parallel from here
 default_data_lumi = 1.
 sys_var_token_up   = '__plus'
 sys_var_token_down = '__minus'
@@ -44,11 +49,26 @@ use_parallel_chains = True
 not_ask_execute = False
 suppress_eventloop_exec = False
 try_reuse_results = True
+max_loaded_results = 0  # results kept after lookups from disk, 0: no limit
+reuse_by_fingerprint = False  # rerun tools only if their inputs changed
+fingerprint_settings = []  # names of settings that are inputs of every tool
 default_enable_sample = True
 fwlite_force_reuse = False
 fwlite_profiling = False
 fileservice_filename = 'fileservice'
 max_open_root_files = 998
+io_write_behind = False  # write results and plots in a background thread
+io_write_behind_queue_size = 16
+io_skip_unchanged_writes = False  # compare digests, do not rewrite same files
+sparseio_update = False  # only replace given plots in sparseio directories
+sparseio_parallel_export = False  # save images in worker processes
+ship_results_max_bytes = 0  # send smaller results from workers to host
+multiproc_report_interval = 0  # seconds between worker utilization reports
+multiproc_memory_budget_mb = 0  # hold back work above this, 0: no limit
+multiproc_persistent_pool = False  # keep workers for all pools (see multiproc)
+profiling = False  # record time, memory and io of every tool
+profiling_cprofile = False  # also run every tool with cProfile
+profiling_report = 'varial_profile.json'  # in varial_working_dir
 
 
 def can_go_parallel():
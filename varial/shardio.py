@@ -0,0 +1,230 @@
+"""
+Store wrappers as single records in an append-only file for every directory.
+
+This module has the same interface as ``pklio``, but every wrapper
+is pickled on its own and appended to ``data.pkls`` in its directory. Hence,
+writing a wrapper does not rewrite the other wrappers of a directory, and
+reading a wrapper does not unpickle the others. As in ``pklio``, histograms
+are stored as raw bin arrays (see :ref:`payload-module`).
+
+The files are locked while they are written to or scanned, so that tools in
+different processes (e.g. in a ``ToolChainParallel``) can share a directory.
+Every record is::
+
+    <uint32 length of name> <uint32 length of pickle> <name> <pickle>
+
+Only the last record of a name is valid. Run ``compact`` to drop the old ones.
+"""
+
+import cPickle
+import struct
+import fcntl
+import os
+
+import analysis
+import monitor
+import payload
+
+
+_filename = 'data.pkls'
+_header = struct.Struct('<II')
+_indices = {}  # file path -> [(st_dev, st_ino), size scanned, {name: (o, l)}]
+_pending = {}  # file path -> [(name, pickle string)]
+_in_a_block = 0
+use_analysis_cwd = True
+
+
+def _file_path(name):
+    path = os.path.dirname(name)
+    if use_analysis_cwd:
+        path = os.path.join(analysis.cwd, path)
+    return os.path.join(path, _filename)
+
+
+def _record(name, data):
+    return _header.pack(len(name), len(data)) + name + data
+
+
+def _is_replaced(f, file_path):
+    # true if the file has been compacted while waiting for the lock
+    try:
+        return os.fstat(f.fileno()).st_ino != os.stat(file_path).st_ino
+    except OSError:
+        return True
+
+
+def _append(file_path, records):
+    data = ''.join(_record(n, d) for n, d in records)
+    while True:
+        with open(file_path, 'ab') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                if _is_replaced(f, file_path):
+                    continue
+                f.write(data)
+                f.flush()
+                return
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _scan(file_path, key=None):
+    """
+    Updates the index of a file with records that were appended since.
+
+    If key is given, the pickle string of its last record is returned, else the
+    index. Both are read with the same file handle, so that compacting in
+    between does no harm.
+    """
+    if not os.path.exists(file_path):
+        _indices.pop(file_path, None)
+        return None if key else {}
+
+    with open(file_path, 'rb') as f:
+        fcntl.flock(f, fcntl.LOCK_SH)
+        try:
+            index = _scan_locked(f, file_path)
+            if not key:
+                return index
+            if key not in index:
+                return None
+            offset, length = index[key]
+            f.seek(offset)
+            return f.read(length)
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _scan_locked(f, file_path):
+    stat = os.fstat(f.fileno())
+    file_id = stat.st_dev, stat.st_ino
+    index = _indices.get(file_path)
+    if not index or index[0] != file_id or index[1] > stat.st_size:
+        index = _indices[file_path] = [file_id, 0, {}]  # new file
+    if index[1] == stat.st_size:
+        return index[2]
+
+    offset = index[1]
+    f.seek(offset)
+    while offset + _header.size <= stat.st_size:
+        len_name, len_data = _header.unpack(f.read(_header.size))
+        if offset + _header.size + len_name + len_data > stat.st_size:
+            break  # incomplete record
+        name = f.read(len_name)
+        offset += _header.size + len_name
+        index[2][name] = offset, len_data
+        offset += len_data
+        f.seek(offset)
+    index[1] = offset
+    return index[2]
+
+
+def _load(file_path, data):
+    try:
+        return payload.decode(cPickle.loads(data))
+    except Exception as e:
+        msg = 'ERROR with file: %s' % file_path
+        e.message += msg
+        monitor.message('shardio', msg)
+        raise
+
+
+def _write_out():
+    for file_path, records in _pending.iteritems():
+        _append(file_path, records)
+    _pending.clear()
+
+
+class _BlockMaker(object):
+    def __enter__(self):
+        global _in_a_block
+        _in_a_block += 1
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        global _in_a_block
+        _in_a_block -= 1
+        if not _in_a_block:
+            _write_out()
+
+
+block_of_files = _BlockMaker()
+
+
+##################################################### read / write wrappers ###
+def exists(name):
+    """Check if data exists."""
+    file_path = _file_path(name)
+    key = os.path.basename(name)
+    return (any(n == key for n, _ in _pending.get(file_path, ()))
+            or key in _scan(file_path))
+
+
+def write(wrp, name=None):
+    """
+    Write a wrapper.
+
+    Within ``block_of_files``, records are appended when the block is left.
+    """
+    file_path = _file_path(name or '_')
+    data = cPickle.dumps(payload.encode(wrp), 2)
+    record = os.path.basename(name or wrp.name), data
+    if _in_a_block:
+        _pending.setdefault(file_path, []).append(record)
+    else:
+        _append(file_path, [record])
+
+
+def read(name):
+    """Read a wrapper."""
+    file_path = _file_path(name)
+    key = os.path.basename(name)
+    for n, data in reversed(_pending.get(file_path, ())):
+        if n == key:
+            return payload.decode(cPickle.loads(data))
+
+    data = _scan(file_path, key)
+    if data:
+        return _load(file_path, data)
+    else:
+        raise RuntimeError('Data not found in: %s' % file_path)
+
+
+def get(name, default=None):
+    """Reads wrapper if availible, else returns default."""
+    try:
+        return read(name)
+    except RuntimeError:
+        return default
+
+
+def compact(path=''):
+    """
+    Rewrites the file of a directory with only the last record of every name.
+
+    :param path:    str, directory (relative to ``analysis.cwd`` if
+                    ``use_analysis_cwd`` is set)
+    """
+    file_path = _file_path(os.path.join(path, '_'))
+    if not os.path.exists(file_path):
+        return
+
+    tmp_path = file_path + '.tmp%d' % os.getpid()
+    with open(file_path, 'rb') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)  # blocks writers while compacting
+        try:
+            index = _scan_locked(f, file_path)
+            with open(tmp_path, 'wb') as tmp:
+                for name, (offset, length) in sorted(
+                    index.iteritems(), key=lambda item: item[1][0]
+                ):
+                    f.seek(offset)
+                    tmp.write(_record(name, f.read(length)))
+            os.rename(tmp_path, file_path)
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+    _indices.pop(file_path, None)
+
+
+################################################### write and close on exit ###
+import atexit
+atexit.register(_write_out)
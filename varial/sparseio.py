@@ -6,43 +6,163 @@ of producing individual .info and .root files for every plot, the info and root
 content accumulated in single files and written at once.
 
 Only generator modules are provided.
+
+The info file is stored by columns: a header with the names and the position
+of every field, followed by one pickled ``{name: value}`` dict per field. Hence,
+``bulk_read_info`` can fetch selected fields without reading the others. Info
+files in the former format (one pickled dict) are still read.
 """
 
 
 from ROOT import TFile
 import cPickle
+import struct
 import os
 
 import settings  # init ROOT first
+import writequeue
+import multiproc
 import generators
 import analysis
+import diskio
 import wrappers
 import monitor
 
 
 _rootfile = '_varial_rootobjects.root.rt'
 _infofile = '_varial_infodata.pkl'
+_exportfile = '_varial_export.root.tmp'
+_columns_magic = '\x00VARIAL_COLS\x00'
+_columns_header = struct.Struct('<HI')  # version, length of header pickle
+_columns_version = 1
 use_analysis_cwd = True
 
 
 def bulk_read_info_dict(dir_path=None):
-    """Returns dict of info-dicts (not wrapper instances)"""
+    """Returns dict of wrappers (Wrapper instances with info only)"""
+    res = bulk_read_info(dir_path)
+    for key in res:
+        res[key] = wrappers.Wrapper(**res[key])
+    return res
+
+
+def bulk_read_info(dir_path=None, names=None, fields=None):
+    """
+    Returns dict of info-dicts (not wrapper instances).
+
+    :param dir_path:    str, directory
+    :param names:       iterable of names to read, default: all
+    :param fields:      iterable of fields to read (e.g. ``('history',)``),
+                        default: all
+    """
     if use_analysis_cwd:
         dir_path = os.path.join(analysis.cwd, dir_path)
     infofile = os.path.join(dir_path, _infofile)
+    writequeue.wait()
+    if fields is None:
+        res = _read_info_file(infofile, names)
+        for info in res.itervalues():
+            info.pop('io_digest', None)
+    else:
+        res = _read_info_file(infofile, names, fields)
+    return res
+
+
+def _read_info_file(infofile, names=None, fields=None):
     if not os.path.exists(infofile):
         return {}
 
-    with open(infofile) as f:
-        res = cPickle.load(f)
-    assert(type(res) == dict)
-    for key in res:
-        res[key] = wrappers.Wrapper(**res[key])
+    with open(infofile, 'rb') as f:
+        if f.read(len(_columns_magic)) != _columns_magic:
+            f.seek(0)
+            return _select(cPickle.load(f), names, fields)  # former format
+
+        version, len_header = _columns_header.unpack(
+            f.read(_columns_header.size))
+        if version > _columns_version:
+            raise RuntimeError(
+                'Info file version %d is not supported: %s' % (
+                    version, infofile))
+        all_names, columns = cPickle.loads(f.read(len_header))[:2]
+        data_start = f.tell()
+        names = all_names if names is None else set(names) & set(all_names)
+        if fields is None:
+            fields = columns.keys()
+
+        res = dict((name, {}) for name in names)
+        for field in fields:
+            if field not in columns:
+                continue
+            offset, length = columns[field]
+            f.seek(data_start + offset)
+            column = cPickle.loads(f.read(length))
+            for name in names:
+                if name in column:
+                    res[name][field] = column[name]
     return res
 
 
-def bulk_write(wrps, name_func, dir_path='', suffices=None, linlog=False):
-    """Writes wrps en block."""
+def _select(info, names, fields):
+    assert(type(info) == dict)
+    if names is not None:
+        info = dict((n, info[n]) for n in names if n in info)
+    if fields is not None:
+        info = dict(
+            (n, dict((k, v) for k, v in i.iteritems() if k in fields))
+            for n, i in info.iteritems()
+        )
+    return info
+
+
+def _read_info_meta(infofile):
+    if not os.path.exists(infofile):
+        return {}
+
+    with open(infofile, 'rb') as f:
+        if f.read(len(_columns_magic)) != _columns_magic:
+            return {}
+        _, len_header = _columns_header.unpack(f.read(_columns_header.size))
+        header = cPickle.loads(f.read(len_header))
+    return header[2] if len(header) > 2 else {}
+
+
+def _write_info_file(infofile, info, meta=None):
+    columns_data = {}
+    for name, wrp_info in info.iteritems():
+        for field, value in wrp_info.iteritems():
+            columns_data.setdefault(field, {})[name] = value
+
+    columns, blobs, offset = {}, [], 0
+    for field, column in columns_data.iteritems():
+        blob = cPickle.dumps(column, 2)
+        columns[field] = offset, len(blob)
+        blobs.append(blob)
+        offset += len(blob)
+
+    header = cPickle.dumps((list(info), columns, meta or {}), 2)
+    with open(infofile, 'wb') as f:
+        f.write(_columns_magic)
+        f.write(_columns_header.pack(_columns_version, len(header)))
+        f.write(header)
+        for blob in blobs:
+            f.write(blob)
+
+
+def bulk_write(wrps, name_func, dir_path='', suffices=None, linlog=False,
+               update=None):
+    """
+    Writes wrps en block.
+
+    With ``settings.io_write_behind``, the files are written in the background
+    and only images are saved right away (see writequeue module).
+
+    :param update:  bool, keep the other content of the directory and only
+                    replace the given names in the info and root file. Replaced
+                    objects leave unused space, which is compacted once it
+                    exceeds the used space. Default: ``settings.sparseio_update``
+    """
+    if update is None:
+        update = settings.sparseio_update
 
     # prepare
     if use_analysis_cwd:
@@ -66,28 +186,80 @@ def bulk_write(wrps, name_func, dir_path='', suffices=None, linlog=False):
             )
         wrps_dict[name] = w
 
-    # write out info
     info = dict((name, w.all_writeable_info())
                 for name, w in wrps_dict.iteritems())
-    with open(infofile, 'w') as f_info:
-        cPickle.dump(info, f_info)
+    unchanged = _find_unchanged(wrps_dict, dir_path, infofile, rootfile,
+                                suffices, linlog, info)
+    if unchanged is None:
+        return wrps_dict.values()
 
-    # write out root file
-    f_root = TFile.Open(rootfile, 'RECREATE')
-    f_root.cd()
+    if writequeue.enabled():
+        # only the files are written in the background, images are saved here
+        detached = dict((name, writequeue.detach(w))
+                        for name, w in wrps_dict.iteritems())
+        writequeue.submit(_write_files, detached, infofile, rootfile, info,
+                          unchanged, update)
+    else:
+        _write_files(wrps_dict, infofile, rootfile, info, unchanged, update)
+    _save_images(wrps_dict, dir_path, rootfile, suffices, linlog, unchanged)
+    return wrps_dict.values()
+
+
+def _find_unchanged(wrps_dict, dir_path, infofile, rootfile, suffices, linlog,
+                    info):
+    # sets the digests in info, returns None if nothing needs to be written
+    unchanged = set()
+    if not settings.io_skip_unchanged_writes:
+        return unchanged
+
+    writequeue.wait()  # for the files of earlier writes
+    old_info = _read_info_file(infofile, fields=('io_digest',))
     for name, w in wrps_dict.iteritems():
-        dirfile = f_root.mkdir(name, name)
-        dirfile.cd()
-        w.obj.Write(name)
-        dirfile.Close()
-    f_root.Close()
+        digest = diskio.content_digest(w)
+        info[name]['io_digest'] = digest
+        if (old_info.get(name, {}).get('io_digest') == digest
+            and all(os.path.exists(p) for p in
+                    _image_paths(dir_path, name, suffices, linlog))):
+            unchanged.add(name)
+    if unchanged:
+        monitor.message(
+            'sparseio',
+            'INFO %d of %d unchanged plot(s) not rewritten in: %s' %
+            (len(unchanged), len(wrps_dict), dir_path)
+        )
+    if (len(unchanged) == len(wrps_dict) == len(old_info)
+        and os.path.exists(rootfile)):
+        return None
+    return unchanged
 
-    # write with suffices
-    for suffix in suffices:
-        if suffix == '.root':
-            continue
 
+def _write_files(wrps_dict, infofile, rootfile, info, unchanged, update):
+    # writes the info and root file (no graphics, may run in the background)
+    if update and os.path.exists(rootfile):
+        _update_files(wrps_dict, infofile, rootfile, info, unchanged)
+    else:
+        # write out info
+        _write_info_file(infofile, info)
+
+        # write out root file
+        f_root = TFile.Open(rootfile, 'RECREATE')
         for name, w in wrps_dict.iteritems():
+            _write_obj(f_root, name, w.obj)
+        f_root.Close()
+
+
+def _save_images(wrps_dict, dir_path, rootfile, suffices, linlog, unchanged):
+    # write with suffices (always in the main thread, as root graphics are not
+    # thread-safe)
+    suffices = list(s for s in suffices if s != '.root')
+    names = list(n for n in wrps_dict if n not in unchanged)
+    if _use_parallel_export(names, suffices):
+        _export_parallel(wrps_dict, names, dir_path, rootfile, suffices, linlog)
+        return
+
+    for suffix in suffices:
+        for name in names:
+            w = wrps_dict[name]
 
             # root will not store filenames with '[]' correctly. fix:
             alt_name = name.replace('[', '(').replace(']', ')')
@@ -110,4 +282,125 @@ def bulk_write(wrps, name_func, dir_path='', suffices=None, linlog=False):
                 if alt_name != name:
                     os.rename(img_path+suffix, good_path+suffix)
 
-    return wrps_dict.values()
+
+def _write_obj(f_root, name, obj):
+    f_root.cd()
+    dirfile = f_root.mkdir(name, name)
+    dirfile.cd()
+    obj.Write(name)
+    dirfile.Close()
+
+
+def _update_files(wrps_dict, infofile, rootfile, info, unchanged):
+    # replaces changed names only, returns False if nothing was written
+    to_write = list(n for n in wrps_dict if n not in unchanged)
+    if not to_write:
+        return False
+
+    all_info = _read_info_file(infofile)
+    n_stale = _read_info_meta(infofile).get('n_stale', 0)
+    n_stale += sum(1 for n in to_write if n in all_info)
+    all_info.update(info)
+
+    if n_stale > len(all_info):
+        _compact_root_file(rootfile, wrps_dict, all_info.keys())
+        n_stale = 0
+    else:
+        f_root = TFile.Open(rootfile, 'UPDATE')
+        for name in to_write:
+            f_root.Delete(name + ';*')
+            _write_obj(f_root, name, wrps_dict[name].obj)
+        f_root.Close()
+
+    _write_info_file(infofile, all_info, {'n_stale': n_stale})
+    return True
+
+
+def _compact_root_file(rootfile, wrps_dict, names):
+    tmpfile = rootfile + '.tmp'
+    f_old = TFile.Open(rootfile, 'READ')
+    f_new = TFile.Open(tmpfile, 'RECREATE')
+    for name in names:
+        if name in wrps_dict:
+            obj = wrps_dict[name].obj
+        else:
+            obj = f_old.Get(name + '/' + name)
+            if not obj:
+                continue
+        _write_obj(f_new, name, obj)
+    f_new.Close()
+    f_old.Close()
+    os.rename(tmpfile, rootfile)
+
+
+def _use_parallel_export(names, suffices):
+    return (settings.sparseio_parallel_export
+            and suffices
+            and len(names) > 1
+            and settings.can_go_parallel())
+
+
+def _export_parallel(wrps_dict, names, dir_path, rootfile, suffices, linlog):
+    # canvases are read from a root file and saved by worker processes
+    if linlog:
+        # store both states of every canvas
+        exportfile = os.path.join(dir_path, _exportfile)
+        f_export = TFile.Open(exportfile, 'RECREATE')
+        for name in names:
+            w = wrps_dict[name]
+            w.main_pad.SetLogy(0)
+            f_export.cd()
+            w.obj.Write(name + '_lin')
+            generators.switch_log_scale_single_cnv(w, False, True)
+            f_export.cd()
+            w.obj.Write(name + '_log')
+            generators.switch_log_scale_single_cnv(w, False, False)
+        f_export.Close()
+        items = list((name + ll, name + ll)
+                     for name in names for ll in ('_lin', '_log'))
+    else:
+        exportfile = rootfile
+        items = list((name + '/' + name, name) for name in names)
+
+    n_workers = min(settings.max_num_processes, len(items))
+    n_tasks = min(n_workers * 4, len(items))
+    tasks = list((exportfile, dir_path, items[i::n_tasks], suffices)
+                 for i in xrange(n_tasks))
+    try:
+        with multiproc.WorkerPool(n_workers) as pool:
+            for _ in pool.imap_unordered(_export_images, tasks):
+                pass
+    finally:
+        if linlog:
+            os.remove(exportfile)
+
+
+def _export_images(args):
+    exportfile, dir_path, items, suffices = args
+    f_export = TFile.Open(exportfile, 'READ')
+    for in_file_path, name in items:
+        cnv = f_export.Get(in_file_path)
+        if not cnv:
+            raise RuntimeError(
+                'Cannot find "%s" in file: %s' % (in_file_path, exportfile))
+
+        # root will not store filenames with '[]' correctly. fix:
+        alt_name = name.replace('[', '(').replace(']', ')')
+        img_path = os.path.join(dir_path, alt_name)
+        good_path = os.path.join(dir_path, name)
+        for suffix in suffices:
+            cnv.SaveAs(img_path + suffix)
+            if alt_name != name:
+                os.rename(img_path + suffix, good_path + suffix)
+    f_export.Close()
+
+
+def _image_paths(dir_path, name, suffices, linlog):
+    path = os.path.join(dir_path, name)
+    if linlog:
+        return list(path + ll + suffix
+                    for suffix in suffices if suffix != '.root'
+                    for ll in ('_lin', '_log'))
+    else:
+        return list(path + suffix
+                    for suffix in suffices if suffix != '.root')
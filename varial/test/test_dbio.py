@@ -1,8 +1,12 @@
 #!/usr/bin/env python
 
+import cPickle
 import os
+from ROOT import TH1, TH1I, TF1
 from test_histotoolsbase import TestHistoToolsBase
+from varial.wrappers import HistoWrapper
 from varial import dbio
+from varial import payload
 from varial import analysis
 
 
@@ -48,6 +52,96 @@ class TestDbio(TestHistoToolsBase):
         # check error
         self.assertRaises(RuntimeError, dbio.read, "non_existent")
 
+    def test_exists_and_block(self):
+        self.assertFalse(dbio.exists(self.test_wrp.name))
+        with dbio.block_of_files:
+            dbio.write(self.test_wrp, 'tool/a')
+            dbio.write(self.test_wrp, 'tool/b')
+            self.assertTrue(dbio._in_transaction)
+        self.assertFalse(dbio._in_transaction)
+        self.assertTrue(dbio.exists('tool/a'))
+
+        # prefix queries
+        dbio.write(self.test_wrp, 'tool2/a')
+        self.assertEqual(dbio.list_names('tool/'), ['tool/a', 'tool/b'])
+        self.assertEqual(sorted(dbio.read_all('tool/')), ['tool/a', 'tool/b'])
+
+    def test_prefix_queries_any_last_char(self):
+        for name in (u'tool/\xff', u'tool/\u20ac', u'tool/\u20acx', 'tool/z'):
+            dbio.write(self.test_wrp, name)
+        self.assertEqual(dbio.list_names(u'tool/\xff'), [u'tool/\xff'])
+        self.assertEqual(dbio.list_names(u'tool/\u20ac'),
+                         [u'tool/\u20ac', u'tool/\u20acx'])
+        self.assertEqual(sorted(dbio.read_all(u'tool/\u20ac')),
+                         [u'tool/\u20ac', u'tool/\u20acx'])
+
+    def test_block_rollback(self):
+        def write_and_fail():
+            with dbio.block_of_files:
+                dbio.write(self.test_wrp, 'tool/a')
+                raise RuntimeError('fail')
+        self.assertRaises(RuntimeError, write_and_fail)
+        self.assertFalse(dbio._in_transaction)
+        self.assertFalse(dbio.exists('tool/a'))
+
+    def test_payload(self):
+        self.test_wrp.histo.Sumw2()
+        enc = payload.encode(self.test_wrp)
+        self.assertEqual(enc[4]['histo'][0], payload._histo_tag)
+        self.assertTrue(0 < payload.estimate_size(self.test_wrp)
+                        <= len(cPickle.dumps(enc, 2)))
+        dec = payload.decode(enc)
+        self.assertEqual(type(dec), type(self.test_wrp))
+        self.assertEqual(dec.name, self.test_wrp.name)
+        for i in xrange(self.test_wrp.histo.GetNbinsX() + 2):
+            self.assertEqual(self.test_wrp.histo.GetBinContent(i),
+                             dec.histo.GetBinContent(i))
+            self.assertEqual(self.test_wrp.histo.GetBinError(i),
+                             dec.histo.GetBinError(i))
+        self.assertEqual(self.test_wrp.histo.GetEntries(),
+                         dec.histo.GetEntries())
+
+        # not a wrapper: unchanged
+        self.assertEqual(payload.decode({'a': 1}), {'a': 1})
+
+    def test_payload_extras(self):
+        histo = self.test_wrp.histo
+        histo.SetOption('hist')
+        histo.SetStats(False)
+        histo.GetXaxis().SetRangeUser(1., 3.)
+        histo.GetXaxis().CenterTitle()
+        histo.GetYaxis().SetTitle('events')
+        histo.GetYaxis().SetTitleOffset(1.7)
+        histo.GetYaxis().SetLabelSize(0.02)
+        dec = payload.decode(payload.encode(self.test_wrp)).histo
+        self.assertEqual(dec.GetOption(), 'hist')
+        self.assertTrue(dec.TestBit(TH1.kNoStats))
+        for ax, dec_ax in ((histo.GetXaxis(), dec.GetXaxis()),
+                           (histo.GetYaxis(), dec.GetYaxis())):
+            self.assertEqual(ax.GetFirst(), dec_ax.GetFirst())
+            self.assertEqual(ax.GetLast(), dec_ax.GetLast())
+            self.assertEqual(ax.GetTitle(), dec_ax.GetTitle())
+            self.assertEqual(ax.GetTitleOffset(), dec_ax.GetTitleOffset())
+            self.assertEqual(ax.GetLabelSize(), dec_ax.GetLabelSize())
+        self.assertTrue(dec.GetXaxis().GetCenterTitle())
+
+        # fit functions are left to pickle
+        histo.GetListOfFunctions().Add(TF1('fit', 'pol1', 0, 5))
+        self.assertIs(payload.encode(self.test_wrp)[4]['histo'], histo)
+
+    def test_payload_default_sumw2(self):
+        histo = TH1I('h_sumw2', '', 2, .5, 4.5)  # unweighted: no sumw2
+        for x in (1, 3, 3):
+            histo.Fill(x)
+        errors = list(histo.GetBinError(i) for i in xrange(4))
+        TH1.SetDefaultSumw2(True)
+        try:
+            dec = payload.decode(payload.encode(HistoWrapper(histo))).histo
+        finally:
+            TH1.SetDefaultSumw2(False)
+        self.assertTrue(dec.GetSumw2N())
+        self.assertEqual(errors, list(dec.GetBinError(i) for i in xrange(4)))
+
 
 import unittest
 suite = unittest.TestLoader().loadTestsFromTestCase(TestDbio)
@@ -1,12 +1,13 @@
 #!/usr/bin/env python
 
 import os
-from ROOT import TH1F
+from ROOT import TH1F, TF1
 from test_histotoolsbase import TestHistoToolsBase
 from varial.wrappers import FileServiceAlias, HistoWrapper, WrapperWrapper
 from varial import diskio
 from varial import analysis
 from varial import settings
+from varial import util
 
 class TestDiskio(TestHistoToolsBase):
     def test_load_histogram(self):
@@ -23,6 +24,46 @@ class TestDiskio(TestHistoToolsBase):
         self.assertTrue(isinstance(wrp.histo, TH1F))
         self.assertAlmostEqual(wrp.histo.Integral(), 280555.0)
 
+    def test_bulk_load_histograms(self):
+        aliases = list(diskio.generate_aliases_list([
+            settings.DIR_FILESERVICE + 'tt.root',
+            settings.DIR_FILESERVICE + 'zjets.root',
+        ]))
+        aliases = aliases[::2] + aliases[1::2]  # interleave files
+        diskio.close_open_root_files()
+        wrps = diskio.bulk_load_histograms(aliases)
+        self.assertEqual(len(wrps), len(aliases))
+        for w, a in zip(wrps, aliases):
+            self.assertEqual(w.file_path, a.file_path)
+            self.assertEqual(w.in_file_path, a.in_file_path)
+        self.assertFalse(diskio._open_root_files)
+
+    def test_dir_cache(self):
+        tt = settings.DIR_FILESERVICE + 'tt.root'
+        aliases = list(diskio.generate_aliases(tt))
+        diskio.close_open_root_files()
+        diskio.load_histogram(aliases[0])
+        dir_path = aliases[0].in_file_path.rpartition('/')[0]
+        self.assertIn(dir_path, diskio._dir_cache[tt])
+        diskio.close_root_file(tt)
+        self.assertNotIn(tt, diskio._dir_cache)
+
+    def test_root_file_pool(self):
+        tt = settings.DIR_FILESERVICE + 'tt.root'
+        zj = settings.DIR_FILESERVICE + 'zjets.root'
+        diskio.close_open_root_files()
+        stats_before = diskio.root_file_stats().get(tt, {})
+        with util.Switch(settings, 'max_open_root_files', 1):
+            diskio.get_open_root_file(tt)
+            diskio.get_open_root_file(tt)
+            diskio.get_open_root_file(zj)  # evicts tt
+            self.assertEqual(list(diskio._open_root_files), [zj])
+        stats = diskio.root_file_stats()[tt]
+        self.assertEqual(stats['hits'] - stats_before.get('hits', 0), 1)
+        self.assertEqual(stats['misses'] - stats_before.get('misses', 0), 1)
+        self.assertEqual(
+            stats['evictions'] - stats_before.get('evictions', 0), 1)
+
     def test_write(self):
         fname = self.test_dir + '/wrp_save.info'
         diskio.write(self.test_wrp, fname)
@@ -53,6 +94,56 @@ class TestDiskio(TestHistoToolsBase):
         self.assertEqual(self.test_wrp.histo.Integral(), loaded.histo.Integral())
         self.assertNotEqual(str(self.test_wrp.histo), str(loaded.histo))
 
+    def test_read_binary_info(self):
+        fname = self.test_dir + '/wrp_load_bin.info'
+        with util.Switch(settings, 'diskio_binary_info', True):
+            diskio.write(self.test_wrp, fname)
+        with open(fname, 'rb') as fhandle:
+            self.assertTrue(
+                fhandle.read().startswith(diskio._binary_info_magic))
+
+        # reading does not depend on the setting
+        loaded = diskio.read(fname)
+        self.test_wrp.history = str(self.test_wrp.history)
+        self.assertEqual(
+            self.test_wrp.all_writeable_info(),
+            loaded.all_writeable_info()
+        )
+        self.assertEqual(self.test_wrp.histo.Integral(), loaded.histo.Integral())
+
+    def test_skip_unchanged_write(self):
+        fname = self.test_dir + '/wrp_skip'
+        with util.Switch(settings, 'io_skip_unchanged_writes', True):
+            diskio.write(self.test_wrp, fname)
+            n_skipped = diskio.n_skipped_writes
+            diskio.write(self.test_wrp, fname)
+            self.assertEqual(diskio.n_skipped_writes, n_skipped + 1)
+            self.assertFalse(hasattr(self.test_wrp, 'io_digest'))
+
+            # changed content must be written
+            self.test_wrp.histo.Fill(1)
+            diskio.write(self.test_wrp, fname)
+            self.assertEqual(diskio.n_skipped_writes, n_skipped + 1)
+        loaded = diskio.read(fname)
+        self.assertEqual(self.test_wrp.histo.Integral(), loaded.histo.Integral())
+
+    def test_content_digest(self):
+        digest = diskio.content_digest(self.test_wrp)
+        self.assertEqual(digest, diskio.content_digest(self.test_wrp))
+
+        # changes that do not touch the bin contents
+        histo = self.test_wrp.histo
+        for change in (
+            lambda: histo.GetXaxis().SetBinLabel(1, 'first'),
+            lambda: histo.GetXaxis().SetRangeUser(1., 3.),
+            lambda: histo.GetYaxis().SetTitleOffset(1.7),
+            lambda: histo.GetListOfFunctions().Add(TF1('fit', 'pol1', 0, 5)),
+        ):
+            change()
+            new_digest = diskio.content_digest(self.test_wrp)
+            self.assertNotEqual(digest, new_digest)
+            digest = new_digest
+
     def test_write_wrpwrp(self):
         fname = self.test_dir + '/wrpwrp_save.info'
         wrpwrp1 = WrapperWrapper([
@@ -85,6 +176,89 @@ class TestDiskio(TestHistoToolsBase):
         self.assertAlmostEqual(wrpwrp2.wrps[1].histo.GetBinContent(1), 0.)
         self.assertAlmostEqual(wrpwrp2.wrps[1].histo.GetBinContent(2), 1.)
 
+    def test_wrpwrp_storage_keys_removed(self):
+        fname = self.test_dir + '/wrpwrp_keys'
+        wrpwrp1 = WrapperWrapper([
+            HistoWrapper(TH1F('h5', 'h5', 2, 0, 2)),
+            HistoWrapper(TH1F('h6', 'h6', 2, 0, 2)),
+        ])
+        diskio.write(wrpwrp1, fname)
+        wrpwrp2 = diskio.read(fname)
+        for wrp in (wrpwrp1, wrpwrp2):
+            info = wrp.all_info()
+            self.assertNotIn('wrpwrp_names', info)
+            self.assertNotIn('wrapped_object_key', info)
+
+        # a read wrapper is written without the keys of its former storage
+        with util.Switch(settings, 'diskio_wrpwrp_container', True):
+            diskio.write(wrpwrp2, fname + '_container')
+        info = diskio._read_info_file(fname + '_container.info')
+        self.assertNotIn('wrpwrp_names', info)
+        self.assertNotIn('wrapped_object_key', info)
+
+    def test_alias_index(self):
+        fname = settings.DIR_FILESERVICE + 'tt.root'
+        with util.Switch(settings, 'varial_working_dir', self.test_dir + '/'):
+            diskio.invalidate_alias_index()
+            aliases = list(diskio.generate_aliases(fname))
+            self.assertTrue(os.path.exists(diskio._alias_index_path()))
+            self.assertIn(os.path.abspath(fname), diskio._get_alias_index())
+
+            # second scan comes from the index and yields the same aliases
+            diskio.close_open_root_files()
+            aliases_idx = list(diskio.generate_aliases(fname))
+            self.assertNotIn(fname, diskio._open_root_files)
+            self.assertEqual(
+                list(a.all_info() for a in aliases),
+                list(a.all_info() for a in aliases_idx)
+            )
+
+            diskio.invalidate_alias_index([fname])
+            self.assertNotIn(os.path.abspath(fname), diskio._get_alias_index())
+            diskio.invalidate_alias_index()
+
+    def test_alias_scan_parallel(self):
+        fname = settings.DIR_FILESERVICE + 'tt.root'
+        fnames = [fname, fname]
+        with util.Switch(settings, 'alias_index_name', ''):
+            serial = list(diskio.generate_aliases_list(fnames))
+            with util.Switch(settings, 'alias_scan_min_files_parallel', 1):
+                diskio.close_open_root_files()
+                parallel = list(diskio.generate_aliases_list(fnames))
+        self.assertEqual(
+            list(a.all_info() for a in serial),
+            list(a.all_info() for a in parallel)
+        )
+
+    def test_read_wrpwrp_container(self):
+        fname = self.test_dir + '/wrpwrp_container'
+        wrpwrp1 = WrapperWrapper([
+            HistoWrapper(TH1F('h5', 'h5', 2, 0, 2)),
+            HistoWrapper(TH1F('h6', 'h6', 2, 0, 2)),
+        ])
+        wrpwrp1.wrps[0].histo.Fill(0.5)
+        wrpwrp1.wrps[1].histo.Fill(1.5)
+        with util.Switch(settings, 'diskio_wrpwrp_container', True):
+            diskio.write(wrpwrp1, fname)
+
+        # one info and one root file only
+        self.assertEqual(
+            sorted(f for f in os.listdir(self.test_dir)
+                   if f.startswith('wrpwrp_container')),
+            ['wrpwrp_container.info', 'wrpwrp_container.root']
+        )
+
+        # read in full
+        wrpwrp2 = diskio.read(fname)
+        self.assertEqual(len(wrpwrp2.wrps), 2)
+        self.assertAlmostEqual(wrpwrp2.wrps[0].histo.GetBinContent(1), 1.)
+        self.assertAlmostEqual(wrpwrp2.wrps[1].histo.GetBinContent(2), 1.)
+
+        # random access
+        wrp = diskio.read_member(fname, 1)
+        self.assertEqual(wrp.name, 'h6')
+        self.assertAlmostEqual(wrp.histo.GetBinContent(2), 1.)
+
 
 import unittest
 suite = unittest.TestLoader().loadTestsFromTestCase(TestDiskio)
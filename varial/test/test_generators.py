@@ -51,6 +51,27 @@ class TestGenerators(TestHistoToolsBase):
         self.assertTrue(isinstance(wrp.histo, TH1F))
         self.assertAlmostEqual(wrp.histo.Integral(), 2889.0)
 
+    def test_gen_load_lazy(self):
+        aliases = list(gen.fs_content())
+        wrps = list(gen.load(aliases, lazy=True))
+        self.assertEqual(len(wrps), len(aliases))
+        self.assertFalse(any(w.is_loaded() for w in wrps))
+
+        wrp = ifilter(
+            lambda w: w.name == 'cutflow' and w.sample == 'zjets',
+            wrps
+        ).next()
+        self.assertFalse(wrp.is_loaded())
+        self.assertTrue(isinstance(wrp.histo, TH1F))
+        self.assertTrue(wrp.is_loaded())
+        self.assertAlmostEqual(wrp.obj.Integral(), 2889.0)
+
+        # the title is the one of the eager path (read with the histogram)
+        lazy = list(gen.load(aliases[:1], lazy=True))[0]
+        eager = gen.load(aliases[:1]).next()
+        self.assertEqual(lazy.title, eager.title)
+        self.assertTrue(lazy.is_loaded())
+
     def test_gen_save(self):
         wrps = gen.fs_filter_sort_load(
             lambda w: w.name == 'cutflow' and w.sample in ['zjets', 'ttgamma']
@@ -10,6 +10,9 @@ from test_diskio import suite as dio_suite
 from test_sparseio import suite as sio_suite
 from test_dbio import suite as dbi_suite
 from test_pklio import suite as pki_suite
+from test_shardio import suite as shi_suite
+from test_multiproc import suite as mpr_suite
+from test_writequeue import suite as wrq_suite
 from test_generators import suite as gen_suite
 from test_ops import suite as ops_suite
 from test_rendering import suite as rnd_suite
@@ -35,6 +38,9 @@ suite = unittest.TestSuite((
     sio_suite,
     dbi_suite,
     pki_suite,
+    shi_suite,
+    mpr_suite,
+    wrq_suite,
     gen_suite,
     rnd_suite,
     tls_suite,
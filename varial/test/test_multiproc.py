@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+import unittest
+import Queue
+import time
+
+from varial import multiproc
+from varial import analysis
+from varial import settings
+from varial import util
+
+
+def _identity(x):
+    return x
+
+
+def _add(a, b):
+    return a + b
+
+
+def _sleep(seconds):
+    time.sleep(seconds)
+    return seconds
+
+
+def _nested_sum(n):
+    with multiproc.WorkerPool(2) as pool:
+        return sum(pool.imap_unordered(_identity, range(n)))
+
+
+class TestMultiproc(unittest.TestCase):
+    def test_costs_largest_first(self):
+        with multiproc.WorkerPool(1) as pool:
+            res = list(pool.imap_unordered(
+                _identity, [1, 3, 2], costs=[1, 3, 2]))
+        self.assertEqual(res, [3, 2, 1])
+
+        with multiproc.WorkerPool(1) as pool:
+            res = list(pool.imap_unordered(
+                _identity, [1, 3, 2], costs=lambda x: -x))
+        self.assertEqual(res, [1, 2, 3])
+
+    def test_utilization(self):
+        messages = []
+        with util.Switch(settings, 'multiproc_report_interval', 1e-6), \
+                util.Switch(multiproc.monitor, 'message',
+                            lambda *args: messages.append(args)):
+            with multiproc.WorkerPool(2) as pool:
+                res = list(pool.imap_unordered(_sleep, [0.1] * 4))
+                utilization = pool.utilization()
+        self.assertEqual(res, [0.1] * 4)
+        self.assertTrue(utilization)
+        for fraction in utilization.itervalues():
+            self.assertTrue(0. < fraction <= 1.)
+        self.assertTrue(messages)
+        self.assertIn('worker utilization', messages[-1][1])
+
+    def test_item_peaks(self):
+        tool_path = analysis.get_current_tool_path()
+        multiproc.take_item_peaks(tool_path)
+        with multiproc.WorkerPool(2) as pool:
+            list(pool.imap_unordered(_identity, range(3)))
+            results = Queue.Queue()
+            pool.apply_async(_add, (1, 2), callback=results.put)
+            pool.wait_for_callback(results)
+        peaks = multiproc.take_item_peaks(tool_path)
+        self.assertEqual(len(peaks), 4)
+        self.assertTrue(all(p >= 0. for p in peaks))
+        self.assertEqual(multiproc.take_item_peaks(tool_path), [])
+
+    def test_memory_budget_nested(self):
+        # the budget is always exceeded: only one item at a time may run, but
+        # items waiting for their nested pools do not count
+        with util.Switch(settings, 'multiproc_memory_budget_mb', 1e-6):
+            with multiproc.WorkerPool(2) as pool:
+                res = sorted(pool.imap_unordered(_nested_sum, [3, 4]))
+        self.assertEqual(res, [3, 6])
+
+    def test_persistent_pool(self):
+        for persistent in (False, True):
+            try:
+                with util.Switch(
+                        settings, 'multiproc_persistent_pool', persistent):
+                    with multiproc.WorkerPool(2) as pool:
+                        res = sorted(pool.imap_unordered(_nested_sum, [3, 4]))
+                        self.assertEqual(res, [3, 6])
+
+                        # same calling convention in both modes
+                        results = Queue.Queue()
+                        pool.apply_async(_add, (1, 2), callback=results.put)
+                        self.assertEqual(pool.wait_for_callback(results), 3)
+            finally:
+                multiproc.close_persistent_pool()
+
+
+suite = unittest.TestLoader().loadTestsFromTestCase(TestMultiproc)
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+
+import os
+from test_histotoolsbase import TestHistoToolsBase
+from varial import shardio
+from varial import analysis
+
+
+class TestShardio(TestHistoToolsBase):
+    def setUp(self):
+        super(TestShardio, self).setUp()
+        analysis.cwd = self.test_dir
+
+    def tearDown(self):
+        analysis.cwd = ''
+        super(TestShardio, self).tearDown()
+
+    def test_write(self):
+        shardio.write(self.test_wrp)
+        self.assertTrue(os.path.exists(self.test_dir + '/data.pkls'))
+        self.assertTrue(shardio.exists(self.test_wrp.name))
+
+        # in a block, records are appended on exit
+        with shardio.block_of_files:
+            shardio.write(self.test_wrp, 'other')
+            self.assertTrue(shardio.exists('other'))
+            self.assertNotIn('other', shardio._scan(
+                self.test_dir + '/data.pkls'))
+        self.assertIn('other', shardio._scan(self.test_dir + '/data.pkls'))
+
+    def test_read(self):
+        self.test_wrp.history = str(self.test_wrp.history)
+        shardio.write(self.test_wrp)
+        shardio._indices.clear()
+        loaded = shardio.read(self.test_wrp.name)
+
+        # check names
+        self.assertEqual(
+            self.test_wrp.all_writeable_info(),
+            loaded.all_writeable_info()
+        )
+
+        # check histograms (same integral, different instance)
+        self.assertEqual(self.test_wrp.histo.Integral(),loaded.histo.Integral())
+        self.assertNotEqual(str(self.test_wrp.histo), str(loaded.histo))
+
+        # check error
+        self.assertRaises(RuntimeError, shardio.read, "non_existent")
+
+    def test_compact(self):
+        self.test_wrp.history = str(self.test_wrp.history)
+        shardio.write(self.test_wrp, 'entry')
+        self.test_wrp.name = 'renamed'
+        shardio.write(self.test_wrp, 'entry')  # supersedes first record
+        size = os.path.getsize(self.test_dir + '/data.pkls')
+        shardio.compact()
+        self.assertLess(os.path.getsize(self.test_dir + '/data.pkls'), size)
+        self.assertEqual(shardio.read('entry').name, 'renamed')
+
+
+import unittest
+suite = unittest.TestLoader().loadTestsFromTestCase(TestShardio)
+if __name__ == '__main__':
+    unittest.main()
@@ -1,11 +1,13 @@
 #!/usr/bin/env python
 
 import os
+from ROOT import TFile
 from test_histotoolsbase import TestHistoToolsBase
 from varial import diskio
 from varial import sparseio
 from varial import wrappers
 from varial import settings
+from varial import util
 
 class TestSparseio(TestHistoToolsBase):
 
@@ -30,6 +32,14 @@ class TestSparseio(TestHistoToolsBase):
             self.assertTrue(os.path.exists(self.test_dir+'/%s.png' % tok))
             self.assertTrue(os.path.exists(self.test_dir+'/%s.pdf' % tok))
 
+    def test_bulk_write_parallel_export(self):
+        with util.Switch(settings, 'sparseio_parallel_export', True):
+            sparseio.bulk_write(
+                self.test_wrps, self.name_func, self.test_dir, ('.png',))
+        for w in self.test_wrps:
+            tok = self.name_func(w)
+            self.assertTrue(os.path.exists(self.test_dir+'/%s.png' % tok))
+
     def test_bulk_read_info_dict(self):
         sparseio.bulk_write(
             self.test_wrps, self.name_func, self.test_dir, ('.png', '.pdf'))
@@ -49,6 +59,36 @@ class TestSparseio(TestHistoToolsBase):
                         for w in read_in.itervalues())
         self.assertDictEqual(dict_out, dict_inp)
 
+    def test_bulk_read_info_partial(self):
+        sparseio.bulk_write(
+            self.test_wrps, self.name_func, self.test_dir, ('.png',))
+        name = self.name_func(self.test_wrps[0])
+        read_in = sparseio.bulk_read_info(
+            self.test_dir, names=[name, 'non_existent'], fields=['history'])
+        self.assertEqual(read_in.keys(), [name])
+        self.assertEqual(read_in[name].keys(), ['history'])
+        self.assertEqual(str(read_in[name]['history']),
+                         str(self.test_wrps[0].history))
+
+    def test_bulk_write_update(self):
+        sparseio.bulk_write(
+            self.test_wrps, self.name_func, self.test_dir, ('.root',))
+        names = sorted(self.name_func(w) for w in self.test_wrps)
+
+        # replace one plot, keep the others
+        for _ in xrange(len(names) + 1):  # enough to trigger compaction
+            sparseio.bulk_write(self.test_wrps[:1], self.name_func,
+                                self.test_dir, ('.root',), update=True)
+        self.assertEqual(sorted(sparseio.bulk_read_info(self.test_dir)), names)
+        f = TFile.Open(self.test_dir + '/' + sparseio._rootfile)
+        self.assertEqual(sorted(k.GetName() for k in f.GetListOfKeys()), names)
+        f.Close()
+        self.assertLessEqual(
+            sparseio._read_info_meta(
+                self.test_dir + '/' + sparseio._infofile)['n_stale'],
+            len(names)
+        )
+
 
 import unittest
 suite = unittest.TestLoader().loadTestsFromTestCase(TestSparseio)
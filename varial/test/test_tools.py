@@ -1,6 +1,12 @@
 #!/usr/bin/env python
 
+from ROOT import TH1F
+import varial.multiproc
+import varial.profiling
+import varial.diskio
+import varial.fingerprint
 import varial.tools
+import varial.util
 import unittest
 import shutil
 import os
@@ -24,6 +30,33 @@ class ResultSearcher(varial.tools.Tool):
         self.result = self.lookup_result(self.input_path)
 
 
+class RunCounter(varial.tools.Tool):
+    n_runs = 0
+
+    def run(self):
+        RunCounter.n_runs += 1
+
+
+class _FailingTool(varial.tools.Tool):
+    def run(self):
+        raise RuntimeError('failing on purpose')
+
+
+class _CountingIO(object):
+    use_analysis_cwd = True
+    block_of_files = varial.diskio.block_of_files
+    n_reads = 0
+
+    @classmethod
+    def get(cls, name):
+        cls.n_reads += 1
+        return varial.wrp.Wrapper(name=name)
+
+
+class _Sample(object):
+    pass
+
+
 class _Prntr(varial.tools.Tool):
     def run(self):
         varial.analysis.print_tool_tree()
@@ -87,6 +120,34 @@ class TestTools(unittest.TestCase):
             varial.analysis.fs_aliases.append('TESTVALUE')
         self.assertListEqual(varial.analysis.fs_aliases, [])
 
+    def test_analysis_restored_in_place(self):
+        varial.analysis.reset()
+        aliases = varial.analysis.fs_aliases
+        aliases.append('BEFORE')
+        with varial.tools.ToolChainVanilla(self.base_name):
+            varial.analysis.fs_aliases += ['TESTVALUE']
+            varial.analysis.active_samples = ['TESTSAMPLE']
+        self.assertIs(varial.analysis.fs_aliases, aliases)
+        self.assertListEqual(aliases, ['BEFORE'])
+        self.assertListEqual(varial.analysis.active_samples, [])
+        varial.analysis.reset()
+
+    def test_analysis_restored_deep(self):
+        varial.analysis.reset()
+        sample = _Sample()
+        sample.files = ['a.root']
+        sample.info = {'lumi': [1.]}
+        varial.analysis.all_samples['s'] = sample
+        with varial.tools.ToolChainVanilla(self.base_name):
+            varial.analysis.all_samples['s'].files.append('b.root')
+            varial.analysis.all_samples['s'].info['lumi'][0] = 2.
+            varial.analysis.all_samples['s'].legend = 'changed'
+        self.assertIs(varial.analysis.all_samples['s'], sample)
+        self.assertListEqual(sample.files, ['a.root'])
+        self.assertDictEqual(sample.info, {'lumi': [1.]})
+        self.assertFalse(hasattr(sample, 'legend'))
+        varial.analysis.reset()
+
     def test_lookup_result(self):
         searchers, chain = self._setup_chains(varial.tools.ToolChain)
         chain = varial.tools.ToolChainVanilla(self.base_name, [chain])
@@ -107,6 +168,147 @@ class TestTools(unittest.TestCase):
                 'Result not found for input_path: %s' % srchr.input_path
             )
 
+    def test_lookup_result_parallel_shipped(self):
+        searchers, chain = self._setup_chains(varial.tools.ToolChainParallel)
+        chain = varial.tools.ToolChainVanilla(self.base_name, [chain])
+        with varial.util.Switch(
+                varial.settings, 'ship_results_max_bytes', 2**20):
+            varial.tools.Runner(chain)
+        for srchr in searchers:
+            self.assertIsNotNone(
+                srchr.result,
+                'Result not found for input_path: %s' % srchr.input_path
+            )
+
+    def test_lookup_result_parallel_persistent(self):
+        searchers, chain = self._setup_chains(varial.tools.ToolChainParallel)
+        chain = varial.tools.ToolChainVanilla(self.base_name, [chain])
+        try:
+            with varial.util.Switch(
+                    varial.settings, 'multiproc_persistent_pool', True):
+                varial.tools.Runner(chain)
+        finally:
+            varial.multiproc.close_persistent_pool()
+        for srchr in searchers:
+            self.assertIsNotNone(
+                srchr.result,
+                'Result not found for input_path: %s' % srchr.input_path
+            )
+
+    def test_lookup_result_dag(self):
+        searcher = ResultSearcher('ResultSearcher', '../ResultCreator')
+        searcher.consumes = ['../ResultCreator']
+        chain = varial.tools.ToolChainVanilla(self.base_name, [
+            varial.tools.ToolChainDAG('DAG', [searcher, ResultCreator()]),
+        ])
+        varial.tools.Runner(chain)
+        self.assertIsNotNone(searcher.result)
+
+    def test_lookup_result_dag_persistent(self):
+        searcher = ResultSearcher('ResultSearcher', '../ResultCreator')
+        searcher.consumes = ['../ResultCreator']
+        chain = varial.tools.ToolChainVanilla(self.base_name, [
+            varial.tools.ToolChainDAG('DAG', [searcher, ResultCreator()]),
+        ])
+        try:
+            with varial.util.Switch(
+                    varial.settings, 'multiproc_persistent_pool', True):
+                varial.tools.Runner(chain)
+        finally:
+            varial.multiproc.close_persistent_pool()
+        self.assertIsNotNone(searcher.result)
+
+    def test_persistent_pool_late_tool(self):
+        # the workers do not know tools that were added after they started
+        def chain(name):
+            return varial.tools.ToolChainVanilla(self.base_name, [
+                varial.tools.ToolChainParallel(name, [ResultCreator()]),
+            ])
+        try:
+            with varial.util.Switch(
+                    varial.settings, 'multiproc_persistent_pool', True):
+                varial.tools.Runner(chain('Early'))
+                with self.assertRaises(RuntimeError):
+                    varial.tools.Runner(chain('Late'))
+        finally:
+            varial.multiproc.close_persistent_pool()
+
+    def test_reuse_by_fingerprint(self):
+        def run_chain():
+            searcher = ResultSearcher('ResultSearcher', '../ResultCreator')
+            varial.tools.Runner(varial.tools.ToolChainVanilla(self.base_name, [
+                ResultCreator(), RunCounter(), searcher
+            ]))
+            return searcher
+
+        RunCounter.n_runs = 0
+        with varial.util.Switch(varial.settings, 'reuse_by_fingerprint', True):
+            run_chain()
+            os.remove(os.path.join(
+                self.base_name, 'ResultCreator',
+                'ResultCreator (result available).log'))
+            searcher = run_chain()  # creator reruns with the same result
+        self.assertEqual(RunCounter.n_runs, 1)
+        self.assertIsNone(searcher.time_fin)
+        self.assertIsNotNone(searcher.result)
+
+    def test_fingerprint_of_functions(self):
+        def make_filter(value):
+            return lambda w: w.x > value
+        stable_repr = varial.fingerprint._stable_repr
+        self.assertEqual(stable_repr(make_filter(1)),
+                         stable_repr(make_filter(1)))
+        self.assertNotEqual(stable_repr(make_filter(1)),
+                            stable_repr(make_filter(2)))
+
+    def test_fingerprint_of_root_objects(self):
+        histo = TH1F('fp_histo', 'fp_histo', 2, 0., 2.)
+        wrp = varial.wrp.HistoWrapper(histo)
+        digests = [varial.fingerprint.result_digest(wrp),
+                   varial.fingerprint.result_digest([wrp])]
+        histo.GetXaxis().SetBinLabel(1, 'changed')  # no change in content
+        self.assertNotEqual(digests[0],
+                            varial.fingerprint.result_digest(wrp))
+        self.assertNotEqual(digests[1],
+                            varial.fingerprint.result_digest([wrp]))
+
+    def test_fingerprint_recording_on_error(self):
+        chain = varial.tools.ToolChainVanilla(self.base_name, [_FailingTool()])
+        with varial.util.Switch(varial.settings, 'reuse_by_fingerprint', True):
+            self.assertRaises(RuntimeError, varial.tools.Runner, chain)
+        self.assertListEqual(varial.fingerprint._recordings, [])
+        varial.analysis.reset()
+
+    def test_profiling_parallel(self):
+        searchers, chain = self._setup_chains(varial.tools.ToolChainParallel)
+        chain = varial.tools.ToolChainVanilla(self.base_name, [chain])
+        del varial.profiling.records[:]
+        with varial.util.Switch(varial.settings, 'profiling', True):
+            varial.tools.Runner(chain)
+        paths = set(r['path'] for r in varial.profiling.records)
+        self.assertIn(
+            self.base_name + '/BaseChain/Creators/InnerCreators/ResultCreator',
+            paths
+        )
+        self.assertIn(self.base_name + '/BaseChain/Searchers', paths)
+        del varial.profiling.records[:]
+
+    def test_loaded_results_lru(self):
+        varial.analysis.reset()
+        proxies = []
+        for i in xrange(3):
+            tool = ResultCreator('ResultCreator%d' % i)
+            tool.io = _CountingIO
+            proxies.append(
+                varial.analysis.ResultProxy(tool, None, tool.name + '/'))
+        _CountingIO.n_reads = 0
+        with varial.util.Switch(varial.settings, 'max_loaded_results', 2):
+            for proxy in proxies + proxies[:1]:
+                self.assertIsNotNone(proxy.get_result())
+        self.assertEqual(_CountingIO.n_reads, 4)  # first one was dropped
+        self.assertIsNone(proxies[1].result)
+        varial.analysis.reset()
+
 
 suite = unittest.TestLoader().loadTestsFromTestCase(TestTools)
 if __name__ == '__main__':
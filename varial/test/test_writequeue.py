@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+import os
+from test_histotoolsbase import TestHistoToolsBase
+from varial import writequeue
+from varial import analysis
+from varial import settings
+from varial import diskio
+from varial import util
+
+
+def _fail():
+    raise RuntimeError('failing on purpose')
+
+
+class TestWritequeue(TestHistoToolsBase):
+    def setUp(self):
+        super(TestWritequeue, self).setUp()
+        analysis.cwd = self.test_dir
+
+    def tearDown(self):
+        writequeue.flush()
+        analysis.cwd = ''
+        super(TestWritequeue, self).tearDown()
+
+    def test_submit_flush(self):
+        done = []
+        for i in xrange(20):
+            writequeue.submit(done.append, i)
+        writequeue.flush()
+        self.assertListEqual(done, range(20))
+
+    def test_error_raised_at_flush(self):
+        writequeue.submit(_fail)
+        owner = analysis.get_current_tool_path()
+        self.assertRaises(RuntimeError, writequeue.flush, owner)
+        writequeue.flush(owner)  # raised only once
+
+    def test_detach(self):
+        detached = writequeue.detach(self.test_wrp)
+        self.assertIsNot(detached.histo, self.test_wrp.histo)
+        integral = detached.histo.Integral()
+        self.test_wrp.histo.Scale(2.)
+        self.test_wrp.name = 'changed'
+        self.assertAlmostEqual(detached.histo.Integral(), integral)
+        self.assertEqual(detached.name, 'Nam3')
+
+    def test_write_behind(self):
+        integral = self.test_wrp.histo.Integral()
+        with util.Switch(settings, 'io_write_behind', True):
+            diskio.write(self.test_wrp)
+            self.test_wrp.histo.Scale(2.)  # after queueing: not written
+            writequeue.flush()
+        self.assertTrue(os.path.exists(self.test_dir + '/Nam3.root'))
+        loaded = diskio.read('Nam3')
+        self.assertAlmostEqual(loaded.histo.Integral(), integral)
+
+
+import unittest
+suite = unittest.TestLoader().loadTestsFromTestCase(TestWritequeue)
+if __name__ == '__main__':
+    unittest.main()
@@ -2,19 +2,26 @@
 Baseclasses for tools and toolchains.
 """
 
+import posixpath
 import inspect
 import string
+import cPickle
+import Queue
 import time
 import sys
 import os
 
 
-from util import ResettableType, deepish_copy
+from util import ResettableType, snapshot, restore_snapshot
+import fingerprint
 import multiproc
+import profiling
 import analysis
 import settings
 import wrappers
+import writequeue
 import monitor
+import payload
 import diskio
 
 
@@ -90,6 +97,7 @@ class Tool(_ToolBase):
     __metaclass__ = ResettableType
     no_reset = False
     can_reuse = True
+    fingerprint_settings = ()  # names of settings that are inputs of the tool
 
     def __init__(self, name=None):
         super(Tool, self).__init__(name)
@@ -137,7 +145,15 @@ class Tool(_ToolBase):
         """Return a list of tool paths for all children."""
         return [self.name]
 
+    def input_files(self):
+        """Files the results depend on (see fingerprint module)."""
+        return []
+
     def wanna_reuse(self, all_reused_before_me):
+        if settings.reuse_by_fingerprint and settings.try_reuse_results:
+            unchanged = fingerprint.is_unchanged(self)
+            if unchanged is not None:
+                all_reused_before_me = unchanged
         if super(Tool, self).wanna_reuse(all_reused_before_me):
             if os.path.exists(self.logfile):
                 return True
@@ -155,6 +171,8 @@ class Tool(_ToolBase):
     def starting(self):
         super(Tool, self).starting()
         self.time_start = time.ctime() + '\n'
+        multiproc.reset_peak_rss()
+        multiproc.take_item_peaks(analysis.get_current_tool_path())
         if os.path.exists(self.logfile):
             os.remove(self.logfile)
         if os.path.exists(self.logfile_res):
@@ -162,11 +180,23 @@ class Tool(_ToolBase):
 
     def finished(self):
         self._write_result()
+        writequeue.flush(analysis.get_current_tool_path())
+        if settings.reuse_by_fingerprint:
+            fingerprint.finish(self)
         self.time_fin = time.ctime() + '\n'
         logfile = self.logfile_res if self.result else self.logfile
+        peak_rss = multiproc.peak_rss_mb()
+        item_peaks = multiproc.take_item_peaks(
+            analysis.get_current_tool_path())
         with open(logfile, 'w') as f:
             f.write(self.time_start)
             f.write(self.time_fin)
+            if peak_rss:
+                f.write('peak memory: %.1f MB\n' % peak_rss)
+            if any(item_peaks):
+                f.write('peak memory of %d pool items: max %.1f MB, '
+                        'sum %.1f MB\n' % (
+                            len(item_peaks), max(item_peaks), sum(item_peaks)))
         super(Tool, self).finished()
 
 
@@ -213,8 +243,9 @@ class ToolChain(_ToolBase):
                     for p in t.tool_paths())
 
     def _run_tool(self, tool):
-        with tool as t:
+        with tool as t, profiling.measure(t) as measurement:
             if tool.wanna_reuse(self._reuse):
+                measurement.reused = True
                 tool.reuse()
                 return
             elif tool.can_reuse:
@@ -224,18 +255,19 @@ class ToolChain(_ToolBase):
                 self._reuse = False
 
             t._reuse = self._reuse
-            t.starting()
-            try:
-                t.run()
-            except:
-                etype, evalue, etb = sys.exc_info()
-                msg = evalue.args[0] if evalue.args else ''
-                if 'exception occured at path (class): ' not in str(msg):
-                    new_msg = '%s\nexception occured at path (class): %s (%s)' % (
-                        evalue, analysis.cwd[:-1], t.__class__.__name__)
-                    evalue = etype(new_msg, *evalue.args[1:])
-                raise etype, evalue, etb
-            t.finished()
+            with fingerprint.recording(t):
+                t.starting()
+                try:
+                    t.run()
+                except:
+                    etype, evalue, etb = sys.exc_info()
+                    msg = evalue.args[0] if evalue.args else ''
+                    if 'exception occured at path (class): ' not in str(msg):
+                        new_msg = '%s\nexception occured at path (class): %s (%s)' % (
+                            evalue, analysis.cwd[:-1], t.__class__.__name__)
+                        evalue = etype(new_msg, *evalue.args[1:])
+                    raise etype, evalue, etb
+                t.finished()
             self._reuse = t._reuse
 
     def _fetch_lazy_eval_tools(self):
@@ -274,29 +306,35 @@ class ToolChainIndie(ToolChain):
 
 class ToolChainVanilla(ToolChain):
     """
-    Makes a deep copy of analysis module, restores on exit. Tools are reset.
+    Restores the analysis module on exit. Tools are reset.
+
+    The data of the analysis module (e.g. ``fs_aliases``, ``all_samples`` and
+    the samples in it) are remembered by reference, at all depths, when
+    entering. On exit, only the containers and objects that were changed are
+    restored, in place. Both steps walk all of the data (see TODO in util).
     """
     def __enter__(self):
         res = super(ToolChainVanilla, self).__enter__()
-        old_analysis_data = {}
-        for key, val in analysis.__dict__.iteritems():
+        self._old_analysis_data = dict(analysis.__dict__)
+        self._analysis_snapshot = snapshot(list(
+            val
+            for key, val in analysis.__dict__.iteritems()
             if not (
                 key[0] == '_'
                 or key == 'results_base'    # must be kept for lookup
                 or key == 'current_result'  # must be kept for lookup
                 or inspect.ismodule(val)
                 or callable(val)
-            ):
-                old_analysis_data[key] = deepish_copy(val)
-            else:
-                old_analysis_data[key] = val
-        self._old_analysis_data = old_analysis_data
+            )
+        ))
         return res
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         analysis.__dict__.clear()
         analysis.__dict__.update(self._old_analysis_data)
+        restore_snapshot(self._analysis_snapshot)
         del self._old_analysis_data
+        del self._analysis_snapshot
         super(ToolChainVanilla, self).__exit__(exc_type, exc_val, exc_tb)
 
     def starting(self):
@@ -320,12 +358,35 @@ class ToolChainVanilla(ToolChain):
 def _run_tool_in_worker(arg):
     chain_path, tool_index = arg
     chain = analysis.lookup_tool(chain_path)
+    return _run_in_worker(chain, chain.tool_chain[tool_index], chain._reuse)
+
+
+def _run_in_worker(chain, tool, reuse):
+    profiling_mark = profiling.mark()
     reuse_status = chain._reuse
-    tool = chain.tool_chain[tool_index]
+    chain._reuse = reuse
     chain._run_tool(tool)
     reused = chain._reuse
     chain._reuse = reuse_status  # reset for next job on worker
-    return tool.name, reused
+    shipped = {}
+    if settings.ship_results_max_bytes:
+        _collect_results(tool, (), shipped)
+    return tool.name, reused, shipped, profiling.take_since(profiling_mark)
+
+
+def _collect_results(tool, path, shipped):
+    # pickled results below the size limit, by path relative to the tool
+    # (results that are estimated to be too large are not encoded at all)
+    max_bytes = settings.ship_results_max_bytes
+    if (isinstance(tool, Tool)
+            and isinstance(tool.result, wrappers.Wrapper)
+            and payload.estimate_size(tool.result) <= max_bytes):
+        data = cPickle.dumps(payload.encode(tool.result), 2)
+        if len(data) <= max_bytes:
+            shipped[path] = data  # these bytes are shipped
+    if isinstance(tool, ToolChain):
+        for t in tool.tool_chain:
+            _collect_results(t, path + (t.name,), shipped)
 
 
 class ToolChainParallel(ToolChain):
@@ -333,6 +394,10 @@ class ToolChainParallel(ToolChain):
     Parallel execution of tools.
 
     Tools must not depend on each other an are executed independently.
+
+    Results are written to disk by the workers and loaded on demand in the host
+    process. Results smaller than ``settings.ship_results_max_bytes`` are sent
+    back directly.
     """
     def __init__(self,
                  name=None,
@@ -344,15 +409,17 @@ class ToolChainParallel(ToolChain):
             name, tools, default_reuse, lazy_eval_tools_func)
         self.n_workers = n_workers
 
-    def _load_results(self, tool):
+    def _load_results(self, tool, shipped=None, path=()):
         analysis.push_tool(tool)
         if isinstance(tool, Tool):
-            tool.reuse()
+            if shipped and path in shipped:
+                tool.result = payload.decode(cPickle.loads(shipped[path]))
+            tool.reuse()  # e.g. aliases of Hadd; results are read on lookup
         if isinstance(tool, ToolChain):
             if tool.lazy_eval_tools_func and not tool.tool_chain:
                 tool.add_tools(tool.lazy_eval_tools_func())
             for t in tool.tool_chain:
-                self._load_results(t)
+                self._load_results(t, shipped, path + (t.name,))
         analysis.pop_tool()
 
     def run(self):
@@ -368,17 +435,137 @@ class ToolChainParallel(ToolChain):
 
         # run processing
         with multiproc.WorkerPool(n_workers) as pool:
-            for name, reused in pool.imap_unordered(_run_tool_in_worker,
-                                                    tool_index_list):
+            for name, reused, shipped, records in pool.imap_unordered(
+                _run_tool_in_worker, tool_index_list
+            ):
+                profiling.add(records)
                 if not reused:
                     self._reuse = False
 
                 with monitor.ErrorLevelContext(2):
-                    self._load_results(self.tool_names[name])
+                    self._load_results(self.tool_names[name], shipped)
 
 
+############################################################## ToolChainDAG ###
+def _run_dag_tool_in_worker(arg):
+    chain_path, tool_index, reuse, dep_indices = arg
+    chain = analysis.lookup_tool(chain_path)
+    for i in dep_indices:
+        _push_result_proxies(chain.tool_chain[i])
+    return _run_in_worker(chain, chain.tool_chain[tool_index], reuse)
+
+
+def _push_result_proxies(tool):
+    # results of tools from other workers are read on first lookup
+    analysis.push_tool(tool)
+    if isinstance(tool, ToolChain):
+        for t in tool.tool_chain:
+            _push_result_proxies(t)
+    analysis.pop_tool()
+
+
+def _consumed_paths(tool):
+    paths = (getattr(tool, 'consumes', None)
+             or getattr(tool, 'input_result_path', None)
+             or ())
+    if isinstance(paths, str):
+        paths = (paths,)
+    return paths
+
+
+def _abs_result_path(key, tool_path, base_name):
+    # resolves a key like analysis.lookup_result does
+    keys = key.split('/')
+    if keys[0] in ('', '.'):
+        keys.pop(0)
+    if keys and keys[0] == '..':
+        return posixpath.normpath(tool_path + '/' + '/'.join(keys))
+    if keys and keys[0] == base_name:
+        keys.pop(0)
+    return posixpath.normpath('/'.join([base_name] + keys))
+
+
+class ToolChainDAG(ToolChainParallel):
+    """
+    Parallel execution of tools with dependencies.
 
-#TODO _load_results => move to analysis and only load on demand
-#TODO profiling in ToolChain._run_tool
-#TODO cProfile.runctx('varial.tools.Runner(tc)', globals(), locals(), 'prof_plotting.out')
+    Tools declare the results they need with a ``consumes`` attribute (a list
+    of paths as for ``lookup_result``). Without it, ``input_result_path`` is
+    used. A tool is started as soon as all tools of this chain, that it
+    depends on, are finished. It is only reused, if they were reused as well.
+    """
 
+    def _dependencies(self, my_path):
+        base_name = analysis.results_base.name
+        tool_paths = list(my_path + '/' + t.name for t in self.tool_chain)
+        deps = []
+        for tool, tool_path in zip(self.tool_chain, tool_paths):
+            dep = set()
+            for key in _consumed_paths(tool):
+                path = _abs_result_path(key, tool_path, base_name)
+                dep.update(
+                    i for i, p in enumerate(tool_paths)
+                    if p != tool_path and (p == path
+                                           or path.startswith(p + '/'))
+                )
+            deps.append(dep)
+
+        # check for cycles
+        done = set()
+        while len(done) < len(deps):
+            ready = set(i for i, d in enumerate(deps)
+                        if i not in done and d <= done)
+            if not ready:
+                raise RuntimeError(
+                    'Cyclic dependencies between tools in %s: %s' % (
+                        self.name, list(self.tool_chain[i].name
+                                        for i in xrange(len(deps))
+                                        if i not in done)))
+            done |= ready
+        return deps
+
+    def run(self):
+        self._fetch_lazy_eval_tools()
+        if not self.tool_chain:
+            return
+
+        # prepare multiprocessing
+        n_tools = len(self.tool_chain)
+        n_workers = self.n_workers or min(n_tools, settings.max_num_processes)
+        my_path = analysis.get_current_tool_path()
+        deps = self._dependencies(my_path)
+        reuse_at_start = self._reuse
+        waiting = set(xrange(n_tools))
+        running = set()
+        reused = {}  # tool index -> bool
+        results = Queue.Queue()
+
+        # run processing
+        with multiproc.WorkerPool(n_workers) as pool:
+            while waiting or running:
+                for i in sorted(waiting):
+                    if all(d in reused for d in deps[i]):
+                        reuse = reuse_at_start and all(
+                            reused[d] for d in deps[i])
+                        waiting.remove(i)
+                        running.add(i)
+                        pool.apply_async(
+                            _run_dag_tool_in_worker,
+                            ((my_path, i, reuse, sorted(deps[i])),),
+                            callback=results.put,
+                        )
+
+                res = pool.wait_for_callback(results)
+                if isinstance(res, tuple) and res and res[0] == 'Exception':
+                    raise res[1]
+
+                name, tool_reused, shipped, records = res
+                profiling.add(records)
+                i = self.tool_chain.index(self.tool_names[name])
+                running.remove(i)
+                reused[i] = tool_reused
+                if not tool_reused:
+                    self._reuse = False
+
+                with monitor.ErrorLevelContext(2):
+                    self._load_results(self.tool_names[name], shipped)
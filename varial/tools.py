@@ -10,6 +10,7 @@ ToolChain                   simple chain of Tool
 ToolChainIndie              as ToolChain, will always reuse tools if possible
 ToolChainVanilla            reset state of :ref:`analysis-module` at end
 ToolChainParallel           parallel execution of independent tools
+ToolChainDAG                parallel execution, respecting dependencies
 =========================== =================================================
 :ref:`plotter-module`
 Plotter                     generic plotter
@@ -44,7 +45,8 @@ from toolinterface import \
     ToolChain, \
     ToolChainIndie, \
     ToolChainVanilla, \
-    ToolChainParallel
+    ToolChainParallel, \
+    ToolChainDAG
 from plotter import \
     Plotter, \
     RootFilePlotter, \
@@ -8,6 +8,7 @@ import random
 import ROOT
 import copy
 import math
+import types
 import os
 
 
@@ -106,6 +107,73 @@ def deepish_copy(obj):
     return obj
 
 
+def snapshot(obj):
+    """
+    Remembers the contents of all containers and objects reachable from obj.
+
+    Like ``deepish_copy``, but only the references in every container and
+    ``__dict__`` are stored, no items are copied. Use ``restore_snapshot`` to
+    undo changes at any depth, in place.
+    """
+    snapshots = []
+    _snapshot(obj, snapshots, set())
+    return snapshots
+
+
+def _snapshot(obj, snapshots, seen):
+    if (
+        isinstance(obj, _atomic_types)
+        or id(obj) in seen
+        or isinstance(obj, type)
+        or callable(obj)
+        or inspect.ismodule(obj)
+        or inspect.isclass(obj)
+    ):
+        return
+    if isinstance(obj, (list, tuple, set)):
+        saved = list(obj)
+        children = saved
+    elif isinstance(obj, dict):
+        saved = obj.items()
+        children = obj.values()
+    elif hasattr(obj, '__dict__'):
+        saved = obj.__dict__.items()
+        children = obj.__dict__.values()
+    else:
+        return
+    seen.add(id(obj))
+    if not isinstance(obj, tuple):  # immutable
+        snapshots.append((obj, saved))
+    for child in children:
+        _snapshot(child, snapshots, seen)
+
+
+def restore_snapshot(snapshots):
+    """Undoes the changes since ``snapshot``, only where needed."""
+    for obj, saved in snapshots:
+        if isinstance(obj, list):
+            if not (len(obj) == len(saved)
+                    and all(a is b for a, b in itertools.izip(obj, saved))):
+                obj[:] = saved
+        elif isinstance(obj, set):
+            if not (len(obj) == len(saved) and all(o in obj for o in saved)):
+                obj.clear()
+                obj.update(saved)
+        else:
+            items = obj if isinstance(obj, dict) else obj.__dict__
+            if not (len(items) == len(saved)
+                    and all(items.get(k, _missing) is v for k, v in saved)):
+                items.clear()
+                items.update(saved)
+
+
+_atomic_types = (basestring, int, long, float, bool, types.NoneType)
+_missing = object()
+# TODO snapshot is O(size of the analysis data) for every ToolChainVanilla.
+# A journal of touched containers (e.g. wrap the analysis data in observing
+# containers) would make entering and exiting O(changes).
+
+
 def setup_legendnames_from_files(pattern):
     import generators as gen  # hide circular dependency
     filenames = gen.resolve_file_pattern(pattern)
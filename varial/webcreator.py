@@ -465,7 +465,12 @@ class WebCreator(toolinterface.Tool):
 
         # images
         crosslink_set = set()
-        sparse_dict = sparseio.bulk_read_info_dict(self.working_dir)
+        sparse_dict = sparseio.bulk_read_info(
+            self.working_dir,
+            names=list(img[:-4] if img.endswith('_lin') else img
+                       for img, _ in image_name_tuples),
+            fields=('name',) if settings.no_toggles else None,
+        )
         for img_lin, img_log in image_name_tuples:
 
             if img_lin.endswith('_lin'):
@@ -476,12 +481,16 @@ class WebCreator(toolinterface.Tool):
 
             # try to get from sparseio
             wrp = sparse_dict.get(img)
+            if wrp:
+                wrp = wrappers.Wrapper(**wrp)
 
             # else look for info file on disk
             img_path = os.path.join(self.working_dir, img_lin or img)
             if (not wrp) and os.path.exists(img_path + '.info'):
-                with open(img_path + '.info') as f:
-                    wrp = wrappers.Wrapper(**diskio._read_wrapper_info(f))
+                with open(img_path + '.info', 'rb') as f:
+                    info = diskio._read_wrapper_info(f)
+                info.pop('io_digest', None)
+                wrp = wrappers.Wrapper(**info)
 
             # else create a dummy wrapper
             if not wrp:
@@ -246,6 +246,9 @@ class HistoWrapper(Wrapper):
         self.histo          = histo
         self.name           = kws.get('name', histo.GetName())
         self.title          = kws.get('title', histo.GetTitle())
+        self._init_histo_info(kws)
+
+    def _init_histo_info(self, kws):
         self.is_data        = kws.get('is_data', False)
         self.is_pseudo_data = kws.get('is_pseudo_data', False)
         self.is_signal      = kws.get('is_signal', False)
@@ -278,6 +281,62 @@ class HistoWrapper(Wrapper):
         return not any((self.is_data, self.is_pseudo_data, self.is_signal))
 
 
+class LazyHistoWrapper(HistoWrapper):
+    """
+    HistoWrapper for an alias, that reads the histogram on first access.
+
+    All information of the alias is available right away, so sorting,
+    filtering and grouping do not read from disk. The histogram is loaded when
+    ``histo`` or ``obj`` is accessed the first time. Unless it is given, the
+    title is the histogram title (as with HistoWrapper), so it is loaded
+    together with the histogram. When stored, the wrapper is written as a
+    HistoWrapper.
+
+    :param alias:   Alias instance
+    :param loader:  callable, takes the alias and returns the histogram and
+                    its title
+    """
+    def __init__(self, alias, loader, **kws):
+        info = alias.all_info()
+        info.update(kws)
+        self._alias         = alias
+        self._loader        = loader
+        Wrapper.__init__(self, **info)
+        self.klass          = HistoWrapper.__name__
+        self.type           = alias.type
+        self.name           = info.get('name', alias.name)
+        if 'title' not in info:
+            del self.title  # set on loading
+        self._init_histo_info(info)
+
+    def __getattr__(self, name):
+        # only called if 'histo' or 'title' is not in __dict__ yet
+        if name not in ('histo', 'title') or '_alias' not in self.__dict__:
+            raise AttributeError(name)
+        self.histo, title = self._loader(self._alias)
+        if 'title' not in self.__dict__:
+            self.title = title
+        return self.__dict__[name]
+
+    def __getstate__(self):
+        self.histo  # load before pickling
+        return self.__dict__
+
+    def __copy__(self):
+        cp = self.__class__.__new__(self.__class__)
+        cp.__dict__.update(self.__dict__)
+        return cp
+
+    def is_loaded(self):
+        return 'histo' in self.__dict__
+
+    def all_info(self):
+        info = Wrapper.all_info(self)
+        for key in ('histo', '_alias', '_loader'):
+            info.pop(key, None)
+        return info
+
+
 class StackWrapper(HistoWrapper):
     """
     Wrapper class for a ROOT histogram stack THStack.
@@ -0,0 +1,164 @@
+"""
+Write-behind queue for the io modules.
+
+With ``settings.io_write_behind``, ``diskio.write`` and ``sparseio.bulk_write``
+hand their work to a background thread, so plotting does not wait for the
+filesystem. The queue is bounded by ``settings.io_write_behind_queue_size``: if
+it is full, the caller waits until there's space again.
+
+Errors in the background thread are stored for the tool that queued the write.
+They are raised when this tool finishes (see ``flush``).
+
+Only files are written in the background (root files and info files). Images
+are saved with ``SaveAs`` in the main thread before, as root graphics are not
+thread-safe. Wrappers are queued as copies with clones of their root objects
+(see ``detach``), so that the background thread never works on root objects
+that are used in the main thread.
+"""
+
+import threading
+import Queue
+import copy
+import sys
+
+import settings  # init ROOT first
+from ROOT import TObject, TH1
+import ROOT
+import analysis
+import wrappers
+import monitor
+
+
+_queue = None
+_thread = None
+_at_exit = False
+_errors = {}  # tool path -> list of exc_info tuples
+_errors_lock = threading.Lock()
+
+
+def _work():
+    while True:
+        owner, func, args, kws = _queue.get()
+        try:
+            func(*args, **kws)
+        except Exception:
+            with _errors_lock:
+                _errors.setdefault(owner, []).append(sys.exc_info())
+        finally:
+            _queue.task_done()
+
+
+def _start():
+    global _queue, _thread
+    try:
+        ROOT.ROOT.EnableThreadSafety()  # before root objects go to the thread
+    except AttributeError:
+        pass  # ROOT 5
+    _queue = Queue.Queue(settings.io_write_behind_queue_size)
+    _thread = threading.Thread(target=_work, name='varial_write_behind')
+    _thread.daemon = True
+    _thread.start()
+
+
+def enabled():
+    """True if writes should be queued (never from the writing thread)."""
+    return (settings.io_write_behind
+            and not _at_exit
+            and threading.current_thread() is not _thread)
+
+
+def _clone(obj):
+    clone = obj.Clone()
+    if isinstance(clone, TH1):
+        clone.SetDirectory(0)
+    return clone
+
+
+def _find_in_clone(canvas_clone, obj, canvas):
+    if not obj:
+        return obj
+    if obj.GetName() == canvas.GetName():
+        return canvas_clone
+    return canvas_clone.FindObject(obj.GetName()) or _clone(obj)
+
+
+def detach(wrp):
+    """
+    Returns a copy of a wrapper, that shares no root objects with the original.
+
+    Root objects are cloned. For canvases, the pads, legend and first object
+    of the copy are taken from the cloned canvas.
+    """
+    wrp = copy.copy(wrp)
+    if isinstance(wrp, wrappers.CanvasWrapper):
+        canvas = wrp.canvas
+        wrp.canvas = _clone(canvas)
+        for key in ('main_pad', 'second_pad', 'legend', 'first_obj'):
+            setattr(wrp, key,
+                    _find_in_clone(wrp.canvas, getattr(wrp, key), canvas))
+        return wrp
+    for key, value in wrp.__dict__.items():
+        if isinstance(value, TObject):
+            setattr(wrp, key, _clone(value))
+    if isinstance(wrp, wrappers.WrapperWrapper):
+        wrp.wrps = list(detach(w) for w in wrp.wrps)
+    return wrp
+
+
+def submit(func, *args, **kws):
+    """Queues func(*args, **kws). Waits if the queue is full."""
+    if not (_thread and _thread.is_alive()):
+        _start()  # first call or new process after a fork
+    owner = analysis.get_current_tool_path()
+    _queue.put((owner, func, args, kws))
+
+
+def wait():
+    """Blocks until all queued writes are done."""
+    if _queue and _thread and _thread.is_alive():
+        _queue.join()
+
+
+def flush(owner=None):
+    """
+    Waits for all writes and raises the first error of a tool.
+
+    :param owner:   str, tool path as given by
+                    ``analysis.get_current_tool_path()``,
+                    default: ``None`` (errors of all tools)
+    """
+    wait()
+    with _errors_lock:
+        if owner is None:
+            errors = list(e for es in _errors.itervalues() for e in es)
+            _errors.clear()
+        else:
+            errors = _errors.pop(owner, [])
+    if errors:
+        etype, evalue, etb = errors[0]
+        raise etype, evalue, etb
+
+
+def flush_at_exit():
+    """
+    Waits for all writes and reports errors. Later writes are not queued.
+
+    Registered by diskio, so that it runs before the files are closed.
+    """
+    global _at_exit
+    _at_exit = True
+    try:
+        flush()
+    except Exception as e:
+        monitor.message(
+            'writequeue',
+            'ERROR while writing in the background: %s' % str(e)
+        )
+
+
+############################################################ wait for forks ###
+import multiproc
+
+
+multiproc.pre_fork_cbs.append(wait)
+multiproc.pre_join_cbs.append(wait)
@@ -13,6 +13,11 @@ import itertools
 import os
 
 
+def _file_size(filename):
+    # cost hint for the worker pool (remote files count as zero)
+    return os.path.getsize(filename) if os.path.exists(filename) else 0
+
+
 class TreeProjectorBase(varial.tools.Tool):
     """
     Project histograms from files with TTrees.
@@ -126,8 +131,12 @@ class TreeProjector(TreeProjectorBase):
             res = ((varial.analysis.get_current_tool_path(), s)
                    for s in self.samples)
 
-            # work
-            res = pool.imap_unordered(_handle_sample, res)
+            # work (largest samples first)
+            res = pool.imap_unordered(
+                _handle_sample, res,
+                costs=lambda args: sum(
+                    _file_size(f) for f in self.filenames[args[1]]),
+            )
             for _ in res:
                 pass
 
@@ -198,7 +207,10 @@ class TreeProjectorFileBased(TreeProjectorBase):
                for f in files)
 
         with varial.multiproc.WorkerPool(n_procs) as pool:
-            res = pool.imap_unordered(_handle_sample_file, res)
+            res = pool.imap_unordered(
+                _handle_sample_file, res,
+                costs=lambda args: _file_size(args[2]),
+            )
             res = self.cache_reduce_store(res)
             res = list(res)
 